@@ -1,8 +1,20 @@
 from flask import Flask, jsonify
 from flask_cors import CORS
 from config import config
-from models import db
+from models import db, ensure_indexes
+from user_stats import ensure_user_stats
 from routes import main
+from query_counter import init_query_counter
+from sqlite_tuning import init_sqlite_pragmas
+from db_routing import init_read_replicas
+from jobs import job_runner
+from like_buffer import like_buffer
+from response_cache import response_cache
+from message_events import broker as message_events
+from capsule_guard import capsule_guard
+from password_pool import password_pool
+from user_cache import user_cache
+from permissions import permission_cache
 import os
 from werkzeug.exceptions import RequestEntityTooLarge
 
@@ -28,6 +40,17 @@ if not os.path.exists(db_path):
 
 # 初始化数据库
 db.init_app(app)
+init_sqlite_pragmas(app)
+init_read_replicas(app)
+init_query_counter(app)
+job_runner.init_app(app)
+like_buffer.init_app(app)
+response_cache.init_app(app)
+message_events.init_app(app)
+capsule_guard.init_app(app)
+password_pool.init_app(app)
+user_cache.init_app(app)
+permission_cache.init_app(app)
 
 # 动态CORS配置
 cors_origins = app.config.get('CORS_ORIGINS', ['*'])
@@ -71,6 +94,8 @@ if upload_folder and not os.path.exists(upload_folder):
 with app.app_context():
     try:
         db.create_all()
+        ensure_indexes()
+        ensure_user_stats()
         print("✅ 数据库表创建成功")
     except Exception as e:
         print(f"❌ 数据库表创建失败: {e}")
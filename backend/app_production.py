@@ -3,17 +3,34 @@ Timeline Notebook 生产环境后端应用
 严格按照生产环境最佳实践配置
 """
 
-from flask import Flask, jsonify
+from flask import Flask, jsonify, send_file, make_response
 from flask_cors import CORS
 from config import config
-from models import db
+from models import db, ensure_indexes
+from user_stats import ensure_user_stats
 from routes import main
+from query_counter import init_query_counter
+from sqlite_tuning import init_sqlite_pragmas
+from db_routing import init_read_replicas
+from jobs import job_runner
+from like_buffer import like_buffer
+from response_cache import response_cache
+from message_events import broker as message_events
+from capsule_guard import capsule_guard
+from password_pool import password_pool
+from user_cache import user_cache
+from permissions import permission_cache
+import media_store
 import os
+import mimetypes
 import logging
 from logging.handlers import RotatingFileHandler
 from werkzeug.exceptions import RequestEntityTooLarge
 import sys
 
+# 内容不变的上传文件缓存一年
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
 def create_app():
     """创建生产环境Flask应用"""
     
@@ -58,6 +75,17 @@ def create_app():
         os.chmod(db_path, 0o644)  # 生产环境使用更严格的权限
     
     db.init_app(app)
+    init_sqlite_pragmas(app)
+    init_read_replicas(app)
+    init_query_counter(app)
+    job_runner.init_app(app)
+    like_buffer.init_app(app)
+    response_cache.init_app(app)
+    message_events.init_app(app)
+    capsule_guard.init_app(app)
+    password_pool.init_app(app)
+    user_cache.init_app(app)
+    permission_cache.init_app(app)
     
     # 🔒 使用统一的CORS配置管理器
     try:
@@ -191,17 +219,41 @@ def create_app():
             if not os.path.isabs(upload_folder):
                 upload_folder = os.path.join(app.root_path, upload_folder)
             
-            file_path = os.path.join(upload_folder, filename)
+            upload_folder = os.path.realpath(upload_folder)
+            file_path = os.path.realpath(os.path.join(upload_folder, filename))
             
-            # 安全检查：防止路径遍历攻击
+            # 安全检查：防止路径遍历攻击（先解析 .. 和符号链接再比较）
             if not os.path.commonpath([upload_folder, file_path]) == upload_folder:
                 app.logger.warning(f"路径遍历攻击尝试: {filename}")
                 return jsonify({'error': '非法文件路径'}), 403
             
-            if not os.path.exists(file_path):
+            if not os.path.isfile(file_path):
                 return jsonify({'error': '文件不存在'}), 404
             
-            return send_file(file_path)
+            # 内容寻址和 uuid 命名的文件内容不变，可以长期缓存
+            immutable = media_store.is_immutable_path(filename)
+            max_age = IMMUTABLE_MAX_AGE if immutable else app.config.get('UPLOADS_CACHE_MAX_AGE', 3600)
+            
+            # 交给 nginx 发送文件，Python 不再传输大文件内容
+            accel_prefix = app.config.get('UPLOADS_ACCEL_REDIRECT_PREFIX')
+            if accel_prefix:
+                response = make_response('')
+                response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{filename}"
+                response.headers['Content-Type'] = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            else:
+                # conditional=True 支持 Range 分段请求以及 If-None-Match / If-Modified-Since 返回 304
+                response = send_file(
+                    file_path,
+                    conditional=True,
+                    etag=media_store.content_etag(filename) or True,
+                    max_age=max_age
+                )
+            
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+            if immutable:
+                response.cache_control.immutable = True
+            return response
             
         except Exception as e:
             app.logger.error(f"静态文件访问错误: {e}")
@@ -214,6 +266,8 @@ def create_app():
     with app.app_context():
         try:
             db.create_all()
+            ensure_indexes()
+            ensure_user_stats()
             app.logger.info("数据库表创建/验证成功")
         except Exception as e:
             app.logger.error(f"数据库初始化失败: {e}")
@@ -0,0 +1,602 @@
+"""
+Timeline Notebook 数据备份与还原
+以 gzip 压缩的 JSON Lines 流式导出全部数据表，还原时逐行解析并批量写入，内存占用与数据量无关
+"""
+
+import gzip
+import json
+import os
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select, func, text
+
+import media_store
+import user_stats
+from response_cache import NAMESPACES, invalidate
+from models import db, User, TimelineEntry, Comment, TimeCapsule, Message, MessageComment, MessageLike, MessageImage, KeywordFilter
+
+BACKUP_FORMAT_VERSION = '2.0'
+BACKUP_EXTENSIONS = ('.jsonl.gz', '.json')
+
+# 按外键依赖顺序排列，还原时按同样顺序写入
+BACKUP_MODELS = [
+    User,
+    TimelineEntry,
+    Comment,
+    TimeCapsule,
+    Message,
+    MessageComment,
+    MessageLike,
+    MessageImage,
+    KeywordFilter,
+]
+
+
+class BackupFormatError(ValueError):
+    """备份文件格式不正确"""
+
+
+def get_backup_dir():
+    """备份文件目录"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backups')
+
+
+def is_backup_filename(filename):
+    return (
+        filename.startswith('backup_')
+        and filename.endswith(BACKUP_EXTENSIONS)
+        and not filename.endswith('.manifest.json')
+    )
+
+
+def backup_id_from_filename(filename):
+    """备份ID为去掉扩展名的文件名"""
+    for ext in BACKUP_EXTENSIONS:
+        if filename.endswith(ext):
+            return filename[:-len(ext)]
+    return filename
+
+
+def validate_backup_id(backup_id):
+    """备份ID会拼接成备份目录下的文件名，不允许包含路径分隔符"""
+    separators = {'/', '\\', os.sep, os.altsep} - {None}
+    if not backup_id or backup_id in ('.', '..') or any(sep in backup_id for sep in separators):
+        raise BackupFormatError('备份ID不合法')
+    return backup_id
+
+
+def find_backup_file(backup_id):
+    """根据备份ID查找备份文件，返回文件名，不存在时返回 None"""
+    validate_backup_id(backup_id)
+    backup_dir = get_backup_dir()
+    for ext in BACKUP_EXTENSIONS:
+        filename = f'{backup_id}{ext}'
+        if os.path.exists(os.path.join(backup_dir, filename)):
+            return filename
+    return None
+
+
+def _serialize_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+# 增量备份的变更追踪方式：
+#   updated_at - 导出 updated_at 不早于上次水位线的行
+#   created_at - 只追加不修改的表，导出 created_at 不早于上次水位线的行
+#   snapshot   - 没有更新时间的小表，每次全量导出
+# 水位线取导出开始前的时间减去安全余量（而不是已导出行的最大值）：时间戳由应用在写入时生成，
+# 导出期间尚未提交的事务提交后，其行的时间戳仍早于导出开始时间，只要事务耗时不超过余量，下次增量就会导出。
+# 事务耗时超过余量的写入仍可能遗漏，增量备份只在暂停写入期间执行时保证与数据库一致。
+INCREMENTAL_STRATEGIES = {
+    'user': 'updated_at',
+    'messages': 'updated_at',
+    'message_comments': 'updated_at',
+    'timeline_entry': 'created_at',
+    'comment': 'created_at',
+    'message_likes': 'created_at',
+    'message_images': 'created_at',
+    'time_capsule': 'snapshot',
+    'keyword_filters': 'snapshot',
+}
+
+
+class BackupExporter:
+    """
+    流式备份导出器：分批读取每张表，逐行写入 gzip 压缩的 JSON Lines 文件
+    传入上次备份的水位线时只导出变更行，并附带每张表的全部主键用于还原时识别删除
+    """
+
+    def __init__(self, batch_size=1000, progress_callback=None, safety_margin=300):
+        self.batch_size = batch_size
+        self.progress_callback = progress_callback
+        self.safety_margin = safety_margin
+        self.counts = {}
+        self.watermarks = {}
+
+    def _change_filter(self, model, since):
+        table = model.__table__
+        strategy = INCREMENTAL_STRATEGIES[model.__tablename__]
+        if since is None or since.get(model.__tablename__) is None or strategy == 'snapshot':
+            return None
+        mark = since[model.__tablename__]
+        if isinstance(mark, int):
+            # 旧版清单按主键记录的水位线
+            return table.c.id > mark
+        # 含等号：同一时刻写入的行宁可重复导出，还原时按主键覆盖
+        return table.c[strategy] >= datetime.fromisoformat(mark)
+
+    def iter_rows(self, model, where=None):
+        """按主键顺序分批读取表中的行，返回列名到值的映射"""
+        table = model.__table__
+        stmt = select(table).order_by(*table.primary_key.columns)
+        if where is not None:
+            stmt = stmt.where(where)
+        result = db.session.execute(stmt.execution_options(yield_per=self.batch_size))
+        for row in result.mappings():
+            yield row
+
+    def iter_ids(self, model):
+        result = db.session.execute(
+            select(model.__table__.c.id).order_by(model.__table__.c.id).execution_options(yield_per=self.batch_size)
+        )
+        for row in result:
+            yield row[0]
+
+    def _write_line(self, fp, record):
+        fp.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+        fp.write('\n')
+
+    def export(self, path, since=None):
+        """
+        导出数据表到 path，返回每张表的行数
+        since 为上次备份的水位线（表名 -> 值），为 None 时导出全量
+        """
+        tmp_path = f'{path}.tmp'
+        incremental = since is not None
+        self.counts = {}
+        # 在读取任何数据之前确定本次的水位线
+        mark = datetime.utcnow() - timedelta(seconds=self.safety_margin)
+        self.watermarks = {
+            table_name: mark for table_name, strategy in INCREMENTAL_STRATEGIES.items() if strategy != 'snapshot'
+        }
+
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as fp:
+            self._write_line(fp, {
+                'type': 'header',
+                'version': BACKUP_FORMAT_VERSION,
+                'mode': 'incremental' if incremental else 'full',
+                'created_at': datetime.now().isoformat(),
+                'tables': [model.__tablename__ for model in BACKUP_MODELS]
+            })
+
+            for model in BACKUP_MODELS:
+                table_name = model.__tablename__
+                count = 0
+                for row in self.iter_rows(model, self._change_filter(model, since)):
+                    self._write_line(fp, {
+                        'type': 'row',
+                        'table': table_name,
+                        'data': {key: _serialize_value(value) for key, value in row.items()}
+                    })
+                    count += 1
+                    if self.progress_callback and count % self.batch_size == 0:
+                        self.progress_callback(table_name, count)
+
+                # 增量备份记录当前全部主键，还原时据此删除已不存在的行
+                if incremental:
+                    self._write_line(fp, {'type': 'ids', 'table': table_name, 'ids': list(self.iter_ids(model))})
+
+                self.counts[table_name] = count
+                if self.progress_callback:
+                    self.progress_callback(table_name, count)
+
+            self._write_line(fp, {'type': 'footer', 'counts': self.counts})
+
+        # 写完再重命名，避免留下不完整的备份文件
+        os.replace(tmp_path, path)
+        self.watermarks = {key: _serialize_value(value) for key, value in self.watermarks.items()}
+        return self.counts
+
+
+# ==================== 备份清单 ====================
+# 每个备份旁保存 <备份ID>.manifest.json，记录模式、水位线以及增量链上的父备份和基础全量备份
+
+def manifest_path(backup_id):
+    validate_backup_id(backup_id)
+    return os.path.join(get_backup_dir(), f'{backup_id}.manifest.json')
+
+
+def load_manifest(backup_id):
+    path = manifest_path(backup_id)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as fp:
+        return json.load(fp)
+
+
+def write_manifest(manifest):
+    path = manifest_path(manifest['id'])
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as fp:
+        json.dump(manifest, fp, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def list_manifests():
+    """返回全部备份清单，按创建时间排序"""
+    backup_dir = get_backup_dir()
+    if not os.path.exists(backup_dir):
+        return []
+    manifests = []
+    for filename in os.listdir(backup_dir):
+        if filename.endswith('.manifest.json'):
+            manifest = load_manifest(filename[:-len('.manifest.json')])
+            if manifest and os.path.exists(os.path.join(backup_dir, manifest['filename'])):
+                manifests.append(manifest)
+    manifests.sort(key=lambda m: m['created_at'])
+    return manifests
+
+
+def resolve_backup_chain(backup_id):
+    """返回从基础全量备份到 backup_id 的清单链，链条不完整时抛出 BackupFormatError"""
+    chain = []
+    current = backup_id
+    while current:
+        manifest = load_manifest(current)
+        if manifest is None or not os.path.exists(os.path.join(get_backup_dir(), manifest['filename'])):
+            raise BackupFormatError(f'备份链不完整，缺少备份: {current}')
+        chain.append(manifest)
+        current = manifest.get('parent')
+    chain.reverse()
+    if chain[0]['mode'] != 'full':
+        raise BackupFormatError('备份链缺少基础全量备份')
+    return chain
+
+
+def find_dependent_backups(backup_id):
+    """返回以 backup_id 为父备份的增量备份ID"""
+    return [m['id'] for m in list_manifests() if m.get('parent') == backup_id]
+
+
+# 旧版（1.0）整体JSON备份的键名到表名的映射
+LEGACY_BACKUP_KEYS = {
+    'users': User,
+    'timeline_entries': TimelineEntry,
+    'comments': Comment,
+    'time_capsules': TimeCapsule,
+}
+
+
+def read_backup_records(fp, filename):
+    """
+    打开备份文件，返回 (文件头, 记录迭代器)
+    记录为 (记录类型, 表名, 数据) 三元组：'row' 对应一行数据，'ids' 对应增量备份中某表的全部主键
+    新格式逐行解析；旧版 .json 备份只能整体加载，仅用于兼容历史文件
+    """
+    if filename.endswith('.jsonl.gz'):
+        lines = gzip.open(fp, 'rt', encoding='utf-8')
+        try:
+            header = json.loads(lines.readline() or '{}')
+        except ValueError:
+            header = {}
+        if header.get('type') != 'header':
+            lines.close()
+            raise BackupFormatError('备份文件格式不正确')
+
+        def iter_records():
+            with lines:
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if record.get('type') == 'row':
+                        yield 'row', record['table'], record['data']
+                    elif record.get('type') == 'ids':
+                        yield 'ids', record['table'], record['ids']
+
+        header.setdefault('mode', 'full')
+        return header, iter_records()
+
+    if filename.endswith('.json'):
+        backup_data = json.load(fp)
+        if not all(key in backup_data for key in LEGACY_BACKUP_KEYS):
+            raise BackupFormatError('备份文件格式不正确')
+
+        def iter_legacy_records():
+            for key, model in LEGACY_BACKUP_KEYS.items():
+                for row in backup_data[key]:
+                    row = dict(row)
+                    row.pop('date', None)
+                    if 'timeline_entry_id' in row:
+                        row['entry_id'] = row.pop('timeline_entry_id')
+                    yield 'row', model.__tablename__, row
+
+        header = {
+            'type': 'header',
+            'version': backup_data.get('version', '1.0'),
+            'mode': 'full',
+            'tables': [model.__tablename__ for model in LEGACY_BACKUP_KEYS.values()]
+        }
+        return header, iter_legacy_records()
+
+    raise BackupFormatError('不支持的备份文件格式')
+
+
+class BackupRestorer:
+    """
+    批量还原器：全量备份先清空涉及的数据表再按批 executemany 写入，
+    增量备份按主键批量覆盖写入并删除已不存在的行
+    保留现有管理员账户，同名用户的外键引用映射到已有账户；同一实例可依次回放整条备份链
+    """
+
+    def __init__(self, batch_size=1000, progress_callback=None):
+        self.batch_size = batch_size
+        self.progress_callback = progress_callback
+        self.counts = {}
+        self._models = {model.__tablename__: model for model in BACKUP_MODELS}
+        self._datetime_columns = {
+            model.__tablename__: {
+                column.name for column in model.__table__.columns
+                if isinstance(column.type, db.DateTime)
+            }
+            for model in BACKUP_MODELS
+        }
+        self._user_id_map = {}
+        self._retained_users = None
+
+    def _clear_tables(self, table_names):
+        """按外键依赖的逆序清空数据，用户表只删除非管理员账户"""
+        for model in reversed(BACKUP_MODELS):
+            if model.__tablename__ not in table_names:
+                continue
+            stmt = model.__table__.delete()
+            if model is User:
+                stmt = stmt.where(User.__table__.c.role != 'admin')
+            db.session.execute(stmt)
+
+    def _prepare_row(self, table_name, data):
+        model = self._models[table_name]
+        columns = model.__table__.columns
+        row = {key: value for key, value in data.items() if key in columns}
+        for key in self._datetime_columns[table_name]:
+            if isinstance(row.get(key), str):
+                row[key] = datetime.fromisoformat(row[key])
+        if 'user_id' in row and row['user_id'] in self._user_id_map:
+            row['user_id'] = self._user_id_map[row['user_id']]
+        return row
+
+    def _insert(self, table_name, rows):
+        db.session.execute(self._models[table_name].__table__.insert(), rows)
+
+    def _upsert(self, table_name, rows):
+        """按主键覆盖写入"""
+        table = self._models[table_name].__table__
+        dialect = db.engine.dialect.name
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        elif dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            ids = [row['id'] for row in rows]
+            db.session.execute(table.delete().where(table.c.id.in_(ids)))
+            self._insert(table_name, rows)
+            return
+
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.id],
+            set_={column.name: stmt.excluded[column.name] for column in table.columns if column.name != 'id'}
+        )
+        db.session.execute(stmt, rows)
+
+    def _flush(self, table_name, rows, write=None):
+        if not rows:
+            return
+        if table_name == User.__tablename__:
+            rows[:] = self._map_user_rows(rows)
+        if rows:
+            (write or self._insert)(table_name, rows)
+            self.counts[table_name] = self.counts.get(table_name, 0) + len(rows)
+            if self.progress_callback:
+                self.progress_callback(table_name, self.counts[table_name])
+        rows.clear()
+
+    def _map_user_rows(self, rows):
+        """
+        处理备份中的用户：管理员账户和与保留账户同名的用户不写入，只记录ID映射；
+        ID与保留账户冲突的用户重新分配ID
+        """
+        if self._retained_users is None:
+            # 一次查询取出所有保留下来的账户
+            self._retained_users = {row.username: row.id for row in db.session.execute(select(User.id, User.username))}
+        retained_ids = set(self._retained_users.values())
+        next_id = None
+
+        result = []
+        for row in rows:
+            old_id = row.get('id')
+            if old_id in self._user_id_map:
+                if self._user_id_map[old_id] in retained_ids:
+                    continue
+                row['id'] = self._user_id_map[old_id]
+            elif row.get('role') == 'admin' or row['username'] in self._retained_users:
+                if row['username'] in self._retained_users and old_id is not None:
+                    self._user_id_map[old_id] = self._retained_users[row['username']]
+                continue
+            elif old_id is None or old_id in retained_ids:
+                if next_id is None:
+                    max_existing = db.session.execute(select(func.max(User.id))).scalar() or 0
+                    next_id = max([max_existing] + [r.get('id') or 0 for r in rows])
+                next_id += 1
+                if old_id is not None:
+                    self._user_id_map[old_id] = next_id
+                row['id'] = next_id
+            result.append(row)
+        return result
+
+    def _delete_missing(self, table_name, ids):
+        """删除数据库中存在、但不在增量备份主键列表中的行"""
+        table = self._models[table_name].__table__
+        keep = {self._user_id_map.get(i, i) for i in ids} if table_name == User.__tablename__ else set(ids)
+        stmt = select(table.c.id)
+        if table_name == User.__tablename__:
+            stmt = stmt.where(table.c.role != 'admin')
+        missing = [row[0] for row in db.session.execute(stmt) if row[0] not in keep]
+        # 分块删除，避免超出数据库参数个数限制
+        for start in range(0, len(missing), 500):
+            db.session.execute(table.delete().where(table.c.id.in_(missing[start:start + 500])))
+
+    def _reset_sequences(self, table_names):
+        """PostgreSQL 显式写入主键后需要同步自增序列"""
+        if db.engine.dialect.name != 'postgresql':
+            return
+        for table_name in table_names:
+            table = self._models[table_name].__table__
+            db.session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM \"{table.name}\"), 1))"
+            ))
+
+    def restore(self, table_names, records):
+        """
+        清空 table_names 中的表，再从记录流还原全量备份，返回每张表写入的行数
+        用户表在备份中排在最前，先整体缓存以便分配ID映射（用户量远小于内容量）
+        """
+        self.counts = {}
+        self._user_id_map = {}
+        self._retained_users = None
+        table_names = {name for name in table_names if name in self._models}
+
+        self._clear_tables(table_names)
+
+        users = []
+        current_table = None
+        batch = []
+        for record_type, table_name, data in records:
+            if record_type != 'row' or table_name not in table_names:
+                continue
+            if table_name == User.__tablename__:
+                users.append(self._prepare_row(table_name, data))
+                continue
+            if users:
+                self._flush(User.__tablename__, users)
+            if table_name != current_table:
+                self._flush(current_table, batch)
+                current_table = table_name
+            batch.append(self._prepare_row(table_name, data))
+            if len(batch) >= self.batch_size:
+                self._flush(current_table, batch)
+
+        self._flush(User.__tablename__, users)
+        self._flush(current_table, batch)
+
+        self._reset_sequences(table_names)
+        return dict(self.counts)
+
+    def apply_incremental(self, records):
+        """在已还原的数据上回放一个增量备份，返回每张表覆盖写入的行数"""
+        counts_before = dict(self.counts)
+        pending_ids = {}
+        current_table = None
+        batch = []
+        for record_type, table_name, data in records:
+            if table_name not in self._models:
+                continue
+            if record_type == 'ids':
+                pending_ids[table_name] = data
+                continue
+            if table_name != current_table:
+                self._flush(current_table, batch, self._upsert)
+                current_table = table_name
+            batch.append(self._prepare_row(table_name, data))
+            if len(batch) >= self.batch_size:
+                self._flush(current_table, batch, self._upsert)
+        self._flush(current_table, batch, self._upsert)
+
+        # 按外键依赖的逆序删除已不存在的行
+        for model in reversed(BACKUP_MODELS):
+            if model.__tablename__ in pending_ids:
+                self._delete_missing(model.__tablename__, pending_ids[model.__tablename__])
+
+        self._reset_sequences(set(pending_ids))
+        return {
+            name: count - counts_before.get(name, 0)
+            for name, count in self.counts.items()
+            if count != counts_before.get(name, 0)
+        }
+
+
+def run_backup_job(progress, filename, batch_size=1000, incremental=False, safety_margin=300):
+    """
+    后台任务：导出备份并写入清单
+    增量模式以最近一次备份为父备份，只导出其水位线之后的变更；没有可用的父备份时退化为全量
+    增量备份只在暂停写入期间执行时保证完整，见 INCREMENTAL_STRATEGIES 的说明
+    """
+    backup_dir = get_backup_dir()
+    os.makedirs(backup_dir, exist_ok=True)
+
+    parent = None
+    if incremental:
+        manifests = list_manifests()
+        parent = manifests[-1] if manifests else None
+
+    exporter = BackupExporter(batch_size=batch_size, progress_callback=progress.update, safety_margin=safety_margin)
+    counts = exporter.export(os.path.join(backup_dir, filename), since=parent['watermarks'] if parent else None)
+
+    backup_id = backup_id_from_filename(filename)
+    manifest = {
+        'id': backup_id,
+        'filename': filename,
+        'mode': 'incremental' if parent else 'full',
+        'base': (parent['base'] or parent['id']) if parent else None,
+        'parent': parent['id'] if parent else None,
+        'created_at': datetime.now().isoformat(),
+        'watermarks': exporter.watermarks,
+        'counts': counts
+    }
+    write_manifest(manifest)
+    return {'filename': filename, 'mode': manifest['mode'], 'base': manifest['base'], 'counts': counts}
+
+
+def run_restore_job(progress, upload_path, filename, batch_size=1000):
+    """后台任务：从已保存的上传文件还原全量备份，完成后删除上传文件"""
+    try:
+        with open(upload_path, 'rb') as fp:
+            header, records = read_backup_records(fp, filename)
+            if header['mode'] != 'full':
+                raise BackupFormatError('增量备份不能单独还原，请选择服务器上的备份链进行还原')
+            restorer = BackupRestorer(batch_size=batch_size, progress_callback=progress.update)
+            user_stats.clear_user_stats()
+            counts = restorer.restore(header['tables'], records)
+        # 还原后的记录引用的上传文件需要重新统计引用计数，用户计数也从明细重建
+        media_store.rebuild_ref_counts()
+        user_stats.rebuild_user_stats()
+        invalidate(*NAMESPACES)
+        db.session.commit()
+        return {'counts': counts}
+    finally:
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+
+
+def run_chain_restore_job(progress, backup_id, batch_size=1000):
+    """后台任务：还原服务器上的备份，增量备份先还原基础全量备份再依次回放增量链"""
+    chain = resolve_backup_chain(backup_id)
+    restorer = BackupRestorer(batch_size=batch_size, progress_callback=progress.update)
+    user_stats.clear_user_stats()
+    applied = []
+    for index, manifest in enumerate(chain):
+        with open(os.path.join(get_backup_dir(), manifest['filename']), 'rb') as fp:
+            header, records = read_backup_records(fp, manifest['filename'])
+            if index == 0:
+                counts = restorer.restore(header['tables'], records)
+            else:
+                counts = restorer.apply_incremental(records)
+        applied.append({'id': manifest['id'], 'mode': manifest['mode'], 'counts': counts})
+    media_store.rebuild_ref_counts()
+    user_stats.rebuild_user_stats()
+    invalidate(*NAMESPACES)
+    db.session.commit()
+    return {'chain': applied}
@@ -0,0 +1,100 @@
+"""
+SQLite 连接参数读写吞吐对比
+模拟 4 个 gunicorn worker 写、4 个 worker 读：在临时数据库上分别以默认设置和 SQLITE_* 配置的 PRAGMA 运行，
+输出每秒写入/读取次数和 database is locked 等错误数
+
+用法: python benchmark_sqlite.py [--writers 4] [--readers 4] [--duration 5]
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from config import config
+from models import db, User, Message
+from sqlite_tuning import init_sqlite_pragmas
+
+
+def create_app(database_uri, tuned):
+    app = Flask(__name__)
+    app.config.from_object(config['development'])
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {}
+    app.config['SQLITE_PRAGMAS_ENABLED'] = tuned
+    db.init_app(app)
+    init_sqlite_pragmas(app)
+    return app
+
+
+def run_worker(database_uri, tuned, kind, duration, results):
+    app = create_app(database_uri, tuned)
+    ok = errors = 0
+    deadline = time.monotonic() + duration
+    with app.app_context():
+        while time.monotonic() < deadline:
+            try:
+                if kind == 'write':
+                    db.session.add(Message(user_id=1, content='x' * 200))
+                    db.session.commit()
+                else:
+                    # 留言墙首页查询
+                    Message.query.order_by(Message.id.desc()).limit(20).all()
+                    db.session.rollback()
+                ok += 1
+            except Exception:
+                db.session.rollback()
+                errors += 1
+    results.put((kind, ok, errors))
+
+
+def run(tuned, writers, readers, duration):
+    tmp_dir = tempfile.mkdtemp(prefix='timeline_bench_')
+    database_uri = f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+    try:
+        app = create_app(database_uri, tuned)
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(username='bench', email='bench@example.com', password_hash='x'))
+            db.session.commit()
+            db.engine.dispose()
+
+        results = multiprocessing.Queue()
+        kinds = ['write'] * writers + ['read'] * readers
+        processes = [
+            multiprocessing.Process(target=run_worker, args=(database_uri, tuned, kind, duration, results))
+            for kind in kinds
+        ]
+        for process in processes:
+            process.start()
+        rows = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        label = '调优' if tuned else '默认'
+        for kind, name in (('write', '写入'), ('read', '读取')):
+            ok = sum(row[1] for row in rows if row[0] == kind)
+            errors = sum(row[2] for row in rows if row[0] == kind)
+            print(f'{label} {name}: {ok / duration:.0f} 次/秒，错误 {errors}')
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite 连接参数读写吞吐对比')
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=5, help='每轮运行秒数')
+    args = parser.parse_args()
+
+    for tuned in (False, True):
+        run(tuned, args.writers, args.readers, args.duration)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+用户统计查询方式对比
+在临时数据库中生成用户、留言、评论和点赞，分别按每页 20、100、500 个用户比较三种取 stats 的方式：
+逐个用户 count()、count_grouped 分组计数、直接读取 user_stats 计数表；输出平均耗时和 SQL 条数，并核对三者结果一致
+
+用法: python benchmark_user_stats.py [--users 500] [--messages 20000] [--comments 40000] [--likes 40000]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from sqlalchemy import event
+from config import config
+from models import db, User, UserStats, Message, MessageComment, MessageLike
+import user_stats
+
+PAGE_SIZES = (20, 100, 500)
+REPEAT = 5
+
+
+def create_app(tmp_dir):
+    app = Flask(__name__)
+    app.config.from_object(config['development'])
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {}
+    db.init_app(app)
+    return app
+
+
+def populate(args):
+    users = [User(username=f'bench{i}', email=f'bench{i}@example.com', password_hash='x') for i in range(args.users)]
+    db.session.add_all(users)
+    db.session.commit()
+    user_ids = [user.id for user in users]
+
+    db.session.execute(Message.__table__.insert(), [
+        {'user_id': random.choice(user_ids), 'content': 'x', 'status': 'published', 'like_count': 0, 'comment_count': 0}
+        for _ in range(args.messages)
+    ])
+    message_ids = [row[0] for row in db.session.execute(db.select(Message.id))]
+    db.session.execute(MessageComment.__table__.insert(), [
+        {'user_id': random.choice(user_ids), 'message_id': random.choice(message_ids), 'content': 'c'}
+        for _ in range(args.comments)
+    ])
+    pairs = {(random.choice(user_ids), random.choice(message_ids)) for _ in range(args.likes)}
+    db.session.execute(MessageLike.__table__.insert(), [
+        {'user_id': user_id, 'message_id': message_id} for user_id, message_id in pairs
+    ])
+    db.session.commit()
+
+    user_stats.rebuild_user_stats()
+    db.session.commit()
+    return user_ids
+
+
+def stats_loop(page):
+    """改造前的写法：每个用户三次 count()"""
+    return {
+        user_id: {
+            'message_count': Message.query.filter_by(user_id=user_id).count(),
+            'comment_count': MessageComment.query.filter_by(user_id=user_id).count(),
+            'like_count': MessageLike.query.join(Message, MessageLike.message_id == Message.id)
+                                          .filter(Message.user_id == user_id).count(),
+        }
+        for user_id in page
+    }
+
+
+def stats_grouped(page):
+    """每张表一次分组计数"""
+    messages = user_stats.count_grouped(Message.user_id, page, Message.id)
+    comments = user_stats.count_grouped(MessageComment.user_id, page, MessageComment.id)
+    likes = user_stats.count_grouped(
+        Message.user_id, page, MessageLike.id,
+        join=(Message, MessageLike.message_id == Message.id)
+    )
+    return {
+        user_id: {
+            'message_count': messages.get(user_id, 0),
+            'comment_count': comments.get(user_id, 0),
+            'like_count': likes.get(user_id, 0),
+        }
+        for user_id in page
+    }
+
+
+def stats_counters(page):
+    """get_users 当前的写法：和用户列表一起读取 user_stats 计数表"""
+    rows = db.session.query(User.id, UserStats).outerjoin(UserStats, UserStats.user_id == User.id) \
+        .filter(User.id.in_(page)).all()
+    return {user_id: user_stats.serialize_stats(stats) for user_id, stats in rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='用户统计查询方式对比')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--comments', type=int, default=40000)
+    parser.add_argument('--likes', type=int, default=40000)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='timeline_bench_')
+    app = create_app(tmp_dir)
+    try:
+        with app.app_context():
+            db.create_all()
+            user_ids = populate(args)
+
+            queries = [0]
+
+            def count_query(*_):
+                queries[0] += 1
+
+            event.listen(db.engine, 'before_cursor_execute', count_query)
+            methods = (('逐个 count()', stats_loop), ('分组计数', stats_grouped), ('计数表', stats_counters))
+            ok = True
+            for size in PAGE_SIZES:
+                page = user_ids[:size]
+                expected = None
+                for name, method in methods:
+                    result = method(page)  # 预热
+                    if expected is None:
+                        expected = result
+                    elif result != expected:
+                        ok = False
+                        print(f'❌ 每页 {size} 个用户：{name} 的结果与逐个 count() 不一致')
+                    queries[0] = 0
+                    started = time.perf_counter()
+                    for _ in range(REPEAT):
+                        method(page)
+                    elapsed = (time.perf_counter() - started) / REPEAT * 1000
+                    print(f'每页 {size:>3} 个用户  {name:<12} {elapsed:8.1f} ms  {queries[0] // REPEAT:>5} 条 SQL')
+            return 0 if ok else 1
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
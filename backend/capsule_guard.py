@@ -0,0 +1,144 @@
+"""
+Timeline Notebook 时间胶囊解锁防护
+令牌桶限流：按胶囊和按客户端分别限制尝试频率，超出时直接拒绝，不访问数据库；
+尝试次数先累计在进程内，由后台线程定期合并写入，答错不再每次产生一个写事务
+"""
+
+import atexit
+import threading
+import time
+import traceback
+
+from flask import current_app, request
+
+import counters
+from models import db, TimeCapsule
+
+
+class TokenBucketLimiter:
+    """进程内令牌桶，capacity 为突发上限，rate 为每秒补充的令牌数"""
+
+    def __init__(self, capacity, rate, max_keys=10000):
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> (令牌数, 上次更新时间)
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        """取一个令牌，返回 (是否允许, 需要等待的秒数)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                allowed, retry_after = True, 0
+            else:
+                self._buckets[key] = (tokens, now)
+                allowed, retry_after = False, (1 - tokens) / self.rate if self.rate else None
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return allowed, retry_after
+
+    def _prune(self, now):
+        # 丢弃已经回满的桶，与从未出现过的 key 等价
+        full_after = self.capacity / self.rate if self.rate else float('inf')
+        for key, (_, updated_at) in list(self._buckets.items()):
+            if now - updated_at >= full_after:
+                del self._buckets[key]
+
+
+class AttemptBuffer:
+    """胶囊尝试次数的写缓冲，每隔 CAPSULE_ATTEMPT_FLUSH_INTERVAL 秒合并写入"""
+
+    def __init__(self):
+        self.app = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+        atexit.register(self.flush)
+
+    def add(self, capsule_id):
+        with self._lock:
+            self._pending[capsule_id] = self._pending.get(capsule_id, 0) + 1
+            if self._thread is None or not self._thread.is_alive():
+                # 延迟启动，gunicorn --preload 时每个 worker fork 后各自启动
+                self._thread = threading.Thread(target=self._run, name='capsule-attempts', daemon=True)
+                self._thread.start()
+
+    def pending(self, capsule_id):
+        with self._lock:
+            return self._pending.get(capsule_id, 0)
+
+    def _run(self):
+        while True:
+            time.sleep(self.app.config.get('CAPSULE_ATTEMPT_FLUSH_INTERVAL', 5))
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        with self.app.app_context():
+            try:
+                for capsule_id, count in pending.items():
+                    counters.increment(TimeCapsule.unlock_attempts, TimeCapsule.id == capsule_id, count)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                traceback.print_exc()
+                with self._lock:
+                    for capsule_id, count in pending.items():
+                        self._pending[capsule_id] = self._pending.get(capsule_id, 0) + count
+            finally:
+                db.session.remove()
+
+
+class CapsuleGuard:
+    def __init__(self, app=None):
+        self.capsule_limiter = None
+        self.client_limiter = None
+        self.attempts = AttemptBuffer()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['capsule_guard'] = self
+        self.capsule_limiter = TokenBucketLimiter(
+            app.config.get('CAPSULE_UNLOCK_CAPSULE_BURST', 10),
+            app.config.get('CAPSULE_UNLOCK_CAPSULE_PER_MINUTE', 10) / 60
+        )
+        self.client_limiter = TokenBucketLimiter(
+            app.config.get('CAPSULE_UNLOCK_CLIENT_BURST', 5),
+            app.config.get('CAPSULE_UNLOCK_CLIENT_PER_MINUTE', 5) / 60
+        )
+        self.attempts.init_app(app)
+
+    @staticmethod
+    def client_key():
+        # 只信任 TRUSTED_PROXY_COUNT 层代理追加的地址：每层代理通过 $proxy_add_x_forwarded_for 在末尾追加它看到的地址，
+        # 倒数第 N 项是最外层可信代理看到的客户端地址，更前面的部分可由客户端伪造
+        proxy_count = current_app.config.get('TRUSTED_PROXY_COUNT', 0)
+        forwarded = request.headers.get('X-Forwarded-For')
+        if proxy_count > 0 and forwarded:
+            addresses = [address.strip() for address in forwarded.split(',')]
+            if len(addresses) >= proxy_count:
+                return addresses[-proxy_count]
+        return request.remote_addr
+
+    def check(self, capsule_id):
+        """按客户端和胶囊两个维度限流，返回 (是否允许, 需要等待的秒数)"""
+        for limiter, key in ((self.client_limiter, self.client_key()), (self.capsule_limiter, capsule_id)):
+            allowed, retry_after = limiter.acquire(key)
+            if not allowed:
+                return False, retry_after
+        return True, 0
+
+
+capsule_guard = CapsuleGuard()
@@ -0,0 +1,95 @@
+"""
+Timeline Notebook 留言评论加载
+一次查询取出一页评论及作者，再一次查询取出回复所引用的父评论（或整棵回复树），
+避免逐条评论查询父评论和用户
+"""
+
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from models import MessageComment
+
+
+def _comment_query():
+    return MessageComment.query.options(joinedload(MessageComment.user))
+
+
+def _normalize_page(page, per_page):
+    # 与 paginate(error_out=False) 的处理保持一致
+    page = page if page and page > 0 else 1
+    per_page = per_page if per_page and per_page > 0 else 20
+    return page, per_page
+
+
+def load_flat_page(message_id, page, per_page):
+    """
+    按发布时间分页取出评论，返回 (评论列表, {父评论ID: 父评论})
+    共两次查询：本页评论及作者、本页之外被引用的父评论及作者
+    """
+    page, per_page = _normalize_page(page, per_page)
+    comments = _comment_query().filter(
+        MessageComment.message_id == message_id
+    ).order_by(
+        MessageComment.created_at.asc(), MessageComment.id.asc()
+    ).limit(per_page).offset((page - 1) * per_page).all()
+
+    parents = {comment.id: comment for comment in comments}
+    missing = {comment.parent_id for comment in comments if comment.parent_id and comment.parent_id not in parents}
+    if missing:
+        for parent in _comment_query().filter(MessageComment.id.in_(missing)):
+            parents[parent.id] = parent
+    return comments, parents
+
+
+def load_thread_page(message_id, page, per_page):
+    """
+    按发布时间分页取出顶层评论，并用递归 CTE 沿 parent_id 取出它们的全部回复
+    返回 (顶层评论列表, {评论ID: [直接回复...]})，共两次查询
+    """
+    page, per_page = _normalize_page(page, per_page)
+    roots = _comment_query().filter(
+        MessageComment.message_id == message_id,
+        MessageComment.parent_id.is_(None)
+    ).order_by(
+        MessageComment.created_at.asc(), MessageComment.id.asc()
+    ).limit(per_page).offset((page - 1) * per_page).all()
+
+    children = {}
+    if not roots:
+        return roots, children
+
+    thread = select(MessageComment.id).where(
+        MessageComment.parent_id.in_([root.id for root in roots])
+    ).cte('comment_thread', recursive=True)
+    thread = thread.union_all(
+        select(MessageComment.id).where(MessageComment.parent_id == thread.c.id)
+    )
+    replies = _comment_query().filter(
+        MessageComment.id.in_(select(thread.c.id))
+    ).order_by(
+        MessageComment.created_at.asc(), MessageComment.id.asc()
+    ).all()
+
+    for reply in replies:
+        children.setdefault(reply.parent_id, []).append(reply)
+    return roots, children
+
+
+def build_tree(roots, children, serialize):
+    """把顶层评论和回复表组装成嵌套结构，每条评论只访问一次"""
+    result = []
+    stack = []
+    for root in roots:
+        node = serialize(root)
+        node['replies'] = []
+        result.append(node)
+        stack.append((root, node))
+
+    while stack:
+        comment, node = stack.pop()
+        for reply in children.get(comment.id, ()):
+            child = serialize(reply)
+            child['replies'] = []
+            node['replies'].append(child)
+            stack.append((reply, child))
+    return result
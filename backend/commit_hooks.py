@@ -0,0 +1,32 @@
+"""
+Timeline Notebook 事务结束回调
+各模块把需要在提交后处理的数据登记在 session.info[键] 中，外层事务提交后交给回调处理，整个事务回滚时丢弃。
+SQLAlchemy 2.1 释放保存点时也会触发 after_commit，保存点回滚也会触发回滚事件，统一在这里只处理外层事务
+"""
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+def on_outer_commit(info_key, callback, on_rollback=None):
+    """
+    注册 session.info[info_key] 的处理回调：外层事务提交后调用 callback(值)；
+    整个事务回滚后丢弃该值，传入 on_rollback 时先以该值调用它
+    """
+
+    def _after_commit(session):
+        if session.in_nested_transaction():
+            return
+        value = session.info.pop(info_key, None)
+        if value:
+            callback(value)
+
+    def _after_soft_rollback(session, previous_transaction):
+        if session.in_transaction():
+            return
+        value = session.info.pop(info_key, None)
+        if value and on_rollback is not None:
+            on_rollback(value)
+
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_soft_rollback', _after_soft_rollback)
@@ -0,0 +1,52 @@
+"""
+Timeline Notebook 条件请求
+列表接口先用一次聚合查询算出校验值（行数、最大时间戳等）生成 ETag，
+与 If-None-Match 一致时直接返回 304，不再查询和序列化列表数据。
+ETag 记录在 g.etag 中，响应缓存把它作为缓存键的一部分，缓存的响应体始终与发出的 ETag 对应
+"""
+
+import hashlib
+import json
+from functools import wraps
+
+from flask import current_app, g, request
+
+
+def compute_etag(validator):
+    """由路径、查询参数和校验值生成 ETag"""
+    payload = json.dumps(
+        [request.path, sorted(request.args.items(multi=True)), validator],
+        default=str, ensure_ascii=False
+    )
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def etag_validated(get_validator):
+    """
+    为 GET 列表接口启用 ETag/304
+    get_validator 返回能反映列表内容变化的可 JSON 序列化值，应只做一次廉价的聚合查询，
+    且只依赖数据库中的数据（各 worker 对相同数据必须得到相同的 ETag）
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+
+            etag = compute_etag(get_validator())
+            g.etag = etag
+            # 经 nginx gzip 后强 ETag 会变成弱 ETag，按弱比较匹配
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'no-cache'
+                return response
+
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+                # 允许客户端缓存，但每次使用前都要带 If-None-Match 重新验证
+                response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
@@ -1,5 +1,6 @@
 import os
 from dotenv import load_dotenv
+from db_routing import build_replica_binds
 
 load_dotenv()
 
@@ -22,6 +23,26 @@ class Config:
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or os.path.join(BASE_DIR, 'static', 'uploads')
     MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 100 * 1024 * 1024))  # 100MB
     
+    # 上传文件缓存时间（秒），内容寻址和 uuid 命名的文件始终按一年缓存
+    UPLOADS_CACHE_MAX_AGE = int(os.environ.get('UPLOADS_CACHE_MAX_AGE', 3600))
+    # 设置后由 nginx 通过 X-Accel-Redirect 发送上传文件，如 /protected-uploads/
+    UPLOADS_ACCEL_REDIRECT_PREFIX = os.environ.get('UPLOADS_ACCEL_REDIRECT_PREFIX', '')
+    
+    # 只读副本地址（逗号分隔），只读接口的查询轮流发往副本
+    DATABASE_READ_URLS = os.environ.get('DATABASE_READ_URLS', '')
+    SQLALCHEMY_BINDS = build_replica_binds(DATABASE_READ_URLS)
+    # 写操作后该会话继续使用主库的秒数，覆盖副本的复制延迟
+    READ_YOUR_WRITES_SECONDS = int(os.environ.get('READ_YOUR_WRITES_SECONDS', 5))
+    
+    # SQLite 连接参数：WAL 日志、锁等待毫秒数、同步级别、页缓存（负数为 KiB）、内存映射字节数、临时表存储位置
+    SQLITE_PRAGMAS_ENABLED = os.environ.get('SQLITE_PRAGMAS_ENABLED', 'true').lower() == 'true'
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -64000))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_TEMP_STORE = os.environ.get('SQLITE_TEMP_STORE', 'MEMORY')
+    
     # 安全配置
     SESSION_COOKIE_SECURE = os.environ.get('FLASK_ENV') == 'production'
     SESSION_COOKIE_HTTPONLY = True
@@ -30,12 +51,80 @@ class Config:
     # CORS配置
     CORS_ORIGINS = os.environ.get('CORS_ORIGINS', '*').split(',')
     
+    # 备份导出/还原每批处理的行数
+    BACKUP_BATCH_SIZE = int(os.environ.get('BACKUP_BATCH_SIZE', 1000))
+    # 增量备份水位线的安全余量（秒），应大于最长的写事务耗时
+    BACKUP_INCREMENTAL_MARGIN = int(os.environ.get('BACKUP_INCREMENTAL_MARGIN', 300))
+    
+    # 后台任务线程数与进度写库间隔（秒）
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_PROGRESS_INTERVAL = float(os.environ.get('JOB_PROGRESS_INTERVAL', 1.0))
+    # 任务心跳间隔（秒），进度写库的任务超过 JOB_STALE_TIMEOUT 秒没有心跳视为执行进程已退出
+    JOB_HEARTBEAT_INTERVAL = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', 10))
+    JOB_STALE_TIMEOUT = float(os.environ.get('JOB_STALE_TIMEOUT', 120))
+    
+    # 点赞写缓冲：开启后点赞先记录在进程内，按间隔（毫秒）合并写入数据库
+    LIKE_WRITE_BEHIND = os.environ.get('LIKE_WRITE_BEHIND', 'false').lower() == 'true'
+    LIKE_FLUSH_INTERVAL_MS = int(os.environ.get('LIKE_FLUSH_INTERVAL_MS', 200))
+    
+    # 关键词过滤匹配器缓存时间（秒），用于多进程间同步规则变更
+    KEYWORD_FILTER_CACHE_TTL = int(os.environ.get('KEYWORD_FILTER_CACHE_TTL', 60))
+    
+    # 公共接口响应缓存：memory（进程内 LRU）、redis 或 none；TTL（秒）与进程内最大条目数
+    RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')
+    RESPONSE_CACHE_REDIS_URL = os.environ.get('RESPONSE_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 30))
+    RESPONSE_CACHE_MAX_SIZE = int(os.environ.get('RESPONSE_CACHE_MAX_SIZE', 256))
+    
+    # 留言墙 SSE 推送：补发缓冲的事件数、保活间隔（秒）、单个连接的最长时间（秒，到期后客户端自动重连）
+    MESSAGE_STREAM_BUFFER_SIZE = int(os.environ.get('MESSAGE_STREAM_BUFFER_SIZE', 1000))
+    MESSAGE_STREAM_HEARTBEAT = int(os.environ.get('MESSAGE_STREAM_HEARTBEAT', 15))
+    MESSAGE_STREAM_MAX_DURATION = int(os.environ.get('MESSAGE_STREAM_MAX_DURATION', 300))
+    # 每个 worker 同时打开的事件流上限（每个占用一个 gthread 线程，应明显小于 GUNICORN_THREADS）、
+    # 轮询事件表的间隔（秒）、事件表保留时间（秒，超出后重连的客户端收到 reset 并重新拉取列表）
+    MESSAGE_STREAM_MAX_CONNECTIONS = int(os.environ.get('MESSAGE_STREAM_MAX_CONNECTIONS', 8))
+    MESSAGE_STREAM_POLL_INTERVAL = float(os.environ.get('MESSAGE_STREAM_POLL_INTERVAL', 1.0))
+    MESSAGE_EVENT_RETENTION = int(os.environ.get('MESSAGE_EVENT_RETENTION', 3600))
+    
+    # 时间胶囊答案哈希的 PBKDF2 迭代次数；调高后旧哈希在下次答对时自动升级
+    CAPSULE_ANSWER_KDF_ITERATIONS = int(os.environ.get('CAPSULE_ANSWER_KDF_ITERATIONS', 200000))
+    # 时间胶囊解锁限流（令牌桶）：每个胶囊、每个客户端的突发次数与每分钟补充次数
+    CAPSULE_UNLOCK_CAPSULE_BURST = int(os.environ.get('CAPSULE_UNLOCK_CAPSULE_BURST', 10))
+    CAPSULE_UNLOCK_CAPSULE_PER_MINUTE = float(os.environ.get('CAPSULE_UNLOCK_CAPSULE_PER_MINUTE', 10))
+    CAPSULE_UNLOCK_CLIENT_BURST = int(os.environ.get('CAPSULE_UNLOCK_CLIENT_BURST', 5))
+    CAPSULE_UNLOCK_CLIENT_PER_MINUTE = float(os.environ.get('CAPSULE_UNLOCK_CLIENT_PER_MINUTE', 5))
+    # 应用前面可信反向代理的层数，大于 0 时才按 X-Forwarded-For 识别客户端地址（docker-compose 中经过 nginx 一层）
+    TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', 0))
+    # 解锁尝试次数合并写库的间隔（秒）
+    CAPSULE_ATTEMPT_FLUSH_INTERVAL = float(os.environ.get('CAPSULE_ATTEMPT_FLUSH_INTERVAL', 5))
+    
+    # 用户密码哈希参数（Werkzeug 格式），修改后旧哈希在用户下次登录时自动升级
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    # 密码哈希进程池：进程数（0 表示在请求线程内计算）、排队上限、等待结果的超时（秒）、繁忙时返回的 Retry-After（秒）
+    PASSWORD_POOL_WORKERS = int(os.environ.get('PASSWORD_POOL_WORKERS', 2))
+    PASSWORD_POOL_QUEUE_DEPTH = int(os.environ.get('PASSWORD_POOL_QUEUE_DEPTH', 16))
+    PASSWORD_POOL_TIMEOUT = float(os.environ.get('PASSWORD_POOL_TIMEOUT', 10))
+    PASSWORD_POOL_RETRY_AFTER = int(os.environ.get('PASSWORD_POOL_RETRY_AFTER', 1))
+    
+    # 登录用户缓存：TTL（秒，其他 worker 中禁用、删除、角色变更的最长生效延迟）与进程内最大条目数
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 10))
+    USER_CACHE_MAX_SIZE = int(os.environ.get('USER_CACHE_MAX_SIZE', 10000))
+    # 用户权限位图缓存时间（秒）
+    PERMISSION_CACHE_TTL = int(os.environ.get('PERMISSION_CACHE_TTL', 60))
+    # 权限位图缓存最多保存的用户数
+    PERMISSION_CACHE_MAX_SIZE = int(os.environ.get('PERMISSION_CACHE_MAX_SIZE', 10000))
+    
     # 日志配置
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    
+    # 调试：统计每个请求的SQL查询数（DEBUG模式下自动开启）
+    SQL_QUERY_COUNTER = os.environ.get('SQL_QUERY_COUNTER', 'false').lower() == 'true'
 
 class DevelopmentConfig(Config):
     DEBUG = True
     SESSION_COOKIE_SECURE = False
+    # 开发环境默认在请求线程中计算密码哈希，不启动进程池
+    PASSWORD_POOL_WORKERS = int(os.environ.get('PASSWORD_POOL_WORKERS', 0))
 
 class ProductionConfig(Config):
     DEBUG = False
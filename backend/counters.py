@@ -0,0 +1,30 @@
+"""
+Timeline Notebook 计数列原子更新
+计数在数据库端以 UPDATE ... SET col = col + n 完成，不经过 ORM 读-改-写，
+并发请求不会互相覆盖；支持 RETURNING 的数据库一条语句同时取回新值
+"""
+
+from sqlalchemy import case, func, select, update
+
+from models import db
+
+
+def increment(column, where, delta=1, minimum=None):
+    """
+    对满足 where 的行执行 column = column + delta，返回更新后的值，没有匹配行时返回 None
+    minimum 不为 None 时结果不低于该值（如取消点赞时计数不减到负数）
+    """
+    model = column.class_
+    # 计数列允许为空，空值按 0 处理
+    value = func.coalesce(column, 0) + delta
+    if minimum is not None:
+        value = case((value < minimum, minimum), else_=value)
+    stmt = update(model).where(where).values({column.key: value})
+
+    if db.session.get_bind().dialect.update_returning:
+        return db.session.execute(stmt.returning(column)).scalar()
+
+    # 不支持 RETURNING 的数据库（如 MySQL）在同一事务内再读取一次
+    if db.session.execute(stmt).rowcount == 0:
+        return None
+    return db.session.execute(select(column).where(where)).scalar()
@@ -0,0 +1,80 @@
+"""
+Timeline Notebook 读写分离
+配置 DATABASE_READ_URLS 后，标记为只读的 GET 接口把查询轮流发往只读副本；
+写操作、请求内发生过写入之后的查询，以及会话刚写入过数据的用户的请求仍使用主库
+"""
+
+import itertools
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+
+READ_REPLICA_PREFIX = 'read_replica_'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PRIMARY_UNTIL_KEY = 'db_primary_until'
+
+_round_robin = itertools.count()
+
+
+def build_replica_binds(read_urls):
+    """把逗号分隔的只读副本地址转换为 SQLALCHEMY_BINDS 配置"""
+    urls = [url.strip() for url in (read_urls or '').split(',') if url.strip()]
+    return {f'{READ_REPLICA_PREFIX}{index}': url for index, url in enumerate(urls)}
+
+
+def get_replica_keys(app):
+    return sorted(key for key in app.config.get('SQLALCHEMY_BINDS') or {} if key.startswith(READ_REPLICA_PREFIX))
+
+
+class RoutingSession(Session):
+    """在只读接口中把查询路由到副本的会话"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            replica = self._get_replica(clause)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _get_replica(self, clause):
+        if not has_request_context() or not g.get('db_read_replica'):
+            return None
+
+        # 一旦发生写入，本请求余下的查询都走主库，保证读到自己的写入
+        if g.get('db_use_primary') or self._flushing or self.new or self.dirty or self.deleted \
+                or (clause is not None and getattr(clause, 'is_dml', False)):
+            g.db_use_primary = True
+            return None
+
+        key = g.get('db_replica_key')
+        if key is None:
+            keys = get_replica_keys(current_app)
+            if not keys:
+                return None
+            # 同一请求内固定使用一个副本，避免不同副本的复制延迟造成前后不一致
+            key = g.db_replica_key = keys[next(_round_robin) % len(keys)]
+        return self._db.engines[key]
+
+
+def read_replica(view):
+    """标记只读接口：查询可以发往只读副本"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method in SAFE_METHODS and session.get(PRIMARY_UNTIL_KEY, 0) < time.time():
+            g.db_read_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def init_read_replicas(app):
+    """有只读副本时，记录执行过写操作的会话，在复制延迟窗口内让其请求继续使用主库"""
+    if not get_replica_keys(app):
+        return
+
+    @app.after_request
+    def stick_to_primary_after_write(response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            session[PRIMARY_UNTIL_KEY] = time.time() + app.config.get('READ_YOUR_WRITES_SECONDS', 5)
+        return response
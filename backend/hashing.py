@@ -0,0 +1,126 @@
+"""
+Timeline Notebook 哈希工具
+时间胶囊答案使用加盐的 PBKDF2-SHA256 存储，迭代次数可配置，比较使用 hmac.compare_digest；
+兼容旧版无盐 SHA-256 哈希，以及迁移脚本把旧哈希整体包裹一层 PBKDF2 后的格式。
+用户密码沿用 Werkzeug 的哈希格式，算法参数由 PASSWORD_HASH_METHOD 配置；
+密码相关函数只接收普通参数，可以直接提交到进程池执行
+"""
+
+import hashlib
+import hmac
+import os
+from functools import lru_cache
+
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash
+
+ANSWER_ALGORITHM = 'pbkdf2_sha256'
+# 迁移格式：对旧版 sha256(答案) 的十六进制结果再做 PBKDF2，无需知道原答案即可升级
+LEGACY_WRAPPED_ALGORITHM = 'pbkdf2_sha256_legacy'
+DEFAULT_ANSWER_ITERATIONS = 200000
+# Werkzeug 3 的默认参数
+DEFAULT_PASSWORD_METHOD = 'scrypt:32768:8:1'
+SALT_BYTES = 16
+
+
+def normalize_answer(answer):
+    # 将答案转为小写并去除首尾空格，提高匹配成功率
+    return answer.strip().lower()
+
+
+def get_answer_iterations():
+    if has_app_context():
+        return current_app.config.get('CAPSULE_ANSWER_KDF_ITERATIONS', DEFAULT_ANSWER_ITERATIONS)
+    return DEFAULT_ANSWER_ITERATIONS
+
+
+def _pbkdf2(value, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', value.encode('utf-8'), salt, iterations).hex()
+
+
+def _encode(algorithm, iterations, salt, digest):
+    return f'{algorithm}${iterations}${salt.hex()}${digest}'
+
+
+def hash_answer(answer, iterations=None):
+    """生成答案哈希：pbkdf2_sha256$迭代次数$盐$摘要"""
+    iterations = iterations or get_answer_iterations()
+    salt = os.urandom(SALT_BYTES)
+    return _encode(ANSWER_ALGORITHM, iterations, salt, _pbkdf2(normalize_answer(answer), salt, iterations))
+
+
+def _legacy_digest(answer):
+    return hashlib.sha256(normalize_answer(answer).encode()).hexdigest()
+
+
+def wrap_legacy_hash(legacy_hash, iterations=None):
+    """把旧版无盐 SHA-256 哈希包裹为加盐 PBKDF2，供迁移脚本批量升级"""
+    iterations = iterations or get_answer_iterations()
+    salt = os.urandom(SALT_BYTES)
+    return _encode(LEGACY_WRAPPED_ALGORITHM, iterations, salt, _pbkdf2(legacy_hash, salt, iterations))
+
+
+def is_legacy_hash(stored_hash):
+    return '$' not in (stored_hash or '')
+
+
+def verify_answer(stored_hash, answer):
+    """常量时间比较答案，支持新格式、迁移格式和旧版无盐格式"""
+    if not stored_hash:
+        return False
+
+    if is_legacy_hash(stored_hash):
+        return hmac.compare_digest(stored_hash, _legacy_digest(answer))
+
+    try:
+        algorithm, iterations, salt_hex, digest = stored_hash.split('$')
+        iterations = int(iterations)
+        salt = bytes.fromhex(salt_hex)
+    except ValueError:
+        return False
+
+    if algorithm == ANSWER_ALGORITHM:
+        candidate = _pbkdf2(normalize_answer(answer), salt, iterations)
+    elif algorithm == LEGACY_WRAPPED_ALGORITHM:
+        candidate = _pbkdf2(_legacy_digest(answer), salt, iterations)
+    else:
+        return False
+    return hmac.compare_digest(digest, candidate)
+
+
+def answer_needs_rehash(stored_hash):
+    """旧格式、迁移格式或迭代次数与当前配置不同的哈希，在答案验证通过后应重新生成"""
+    if is_legacy_hash(stored_hash):
+        return True
+    algorithm, _, rest = stored_hash.partition('$')
+    iterations = rest.partition('$')[0]
+    return algorithm != ANSWER_ALGORITHM or iterations != str(get_answer_iterations())
+
+
+@lru_cache(maxsize=None)
+def resolve_password_method(method):
+    """把简写（如 pbkdf2、scrypt）补全为实际使用的参数，即生成的哈希的前缀；每种配置只生成一次哈希"""
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+def get_password_method():
+    if has_app_context():
+        return resolve_password_method(current_app.config.get('PASSWORD_HASH_METHOD', DEFAULT_PASSWORD_METHOD))
+    return DEFAULT_PASSWORD_METHOD
+
+
+def hash_password(password, method=DEFAULT_PASSWORD_METHOD):
+    return generate_password_hash(password, method)
+
+
+def verify_password(stored_hash, password, method=DEFAULT_PASSWORD_METHOD):
+    """
+    验证密码，返回 (是否正确, 新哈希)；method 为 resolve_password_method 补全后的参数，
+    哈希参数与 method 不同且密码正确时，新哈希为按当前参数重新生成的值，否则为 None
+    """
+    if not stored_hash or not check_password_hash(stored_hash, password):
+        return False, None
+
+    if stored_hash.split('$', 1)[0] == method:
+        return True, None
+    return True, generate_password_hash(password, method)
@@ -0,0 +1,101 @@
+"""
+Timeline Notebook 图片衍生尺寸
+首次请求时用 Pillow 生成缩略图、中等尺寸和 WebP 版本并缓存在磁盘，之后直接作为静态文件提供
+"""
+
+import os
+import uuid
+
+from flask import url_for
+from PIL import Image, ImageOps
+
+import media_store
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+VARIANT_DIR = '_variants'
+
+# 名称 -> (最长边像素, 输出格式)；输出格式为 None 时沿用原图格式
+VARIANTS = {
+    'thumb': (320, None),
+    'medium': (1024, None),
+    'webp': (1024, 'WEBP'),
+}
+
+FORMAT_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+
+
+def is_image(relative_path):
+    return bool(relative_path) and relative_path.rsplit('.', 1)[-1].lower() in IMAGE_EXTENSIONS
+
+
+def _output_format(relative_path, variant):
+    output_format = VARIANTS[variant][1]
+    if output_format:
+        return output_format
+    # GIF 衍生图只取第一帧，保存为 PNG
+    return 'JPEG' if relative_path.rsplit('.', 1)[-1].lower() in {'jpg', 'jpeg'} else 'PNG'
+
+
+def variant_path(relative_path, variant):
+    """衍生图相对上传目录的路径，如 _variants/thumb/ab/cd/<sha256>.jpg"""
+    stem = relative_path.rsplit('.', 1)[0]
+    ext = FORMAT_EXTENSIONS[_output_format(relative_path, variant)]
+    return f'{VARIANT_DIR}/{variant}/{stem}.{ext}'
+
+
+def generate_variant(relative_path, variant):
+    """生成衍生图（已存在则直接返回），返回衍生图相对路径；原图不存在时返回 None"""
+    upload_folder = media_store.get_upload_folder()
+    source = os.path.join(upload_folder, relative_path)
+    target_relative = variant_path(relative_path, variant)
+    target = os.path.join(upload_folder, target_relative)
+
+    if os.path.exists(target):
+        return target_relative
+    if not os.path.exists(source):
+        return None
+
+    max_size, _ = VARIANTS[variant]
+    output_format = _output_format(relative_path, variant)
+
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if output_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        elif image.mode == 'P':
+            image = image.convert('RGBA')
+        image.thumbnail((max_size, max_size))
+
+        # 先写临时文件再重命名，并发请求不会读到不完整的文件
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_path = f'{target}.{uuid.uuid4().hex}.tmp'
+        save_options = {'JPEG': {'quality': 82, 'optimize': True, 'progressive': True},
+                        'PNG': {'optimize': True},
+                        'WEBP': {'quality': 80, 'method': 4}}[output_format]
+        try:
+            image.save(tmp_path, format=output_format, **save_options)
+            os.replace(tmp_path, target)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    return target_relative
+
+
+def variant_urls(relative_path):
+    """
+    图片各衍生尺寸的地址：已生成的直接返回静态文件地址，
+    未生成的指向按需生成接口，生成后重定向到静态文件
+    """
+    if not is_image(relative_path):
+        return None
+
+    upload_folder = media_store.get_upload_folder()
+    urls = {}
+    for variant in VARIANTS:
+        target_relative = variant_path(relative_path, variant)
+        if os.path.exists(os.path.join(upload_folder, target_relative)):
+            urls[variant] = url_for('static', filename=f'uploads/{target_relative}')
+        else:
+            urls[variant] = url_for('main.get_image_variant', variant=variant, filename=relative_path)
+    return urls
@@ -2,7 +2,7 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from models import db, User, KeywordFilter
+from models import db, User, KeywordFilter, ensure_indexes
 from flask import Flask
 from config import config
 
@@ -19,6 +19,7 @@ def init_database():
     with app.app_context():
         # 创建所有表
         db.create_all()
+        ensure_indexes()
         
         # 检查是否已存在管理员用户
         admin_user = User.query.filter_by(username='admin').first()
@@ -0,0 +1,251 @@
+"""
+Timeline Notebook 后台任务执行器
+耗时操作（备份、还原）提交到线程池执行，请求立即返回任务ID，状态记录在 background_jobs 表中。
+任务记录执行进程（主机名:pid）和心跳时间，worker 被回收或被杀死后，遗留的 pending/running 任务
+在下次查询任务状态时标记为失败
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+from models import db, BackgroundJob
+
+
+class JobProgress:
+    """
+    任务进度上报器，按间隔节流写库，避免每批数据都产生一次写事务
+    持有数据库写锁的任务（如 SQLite 上的还原）应关闭 persist，进度只保存在进程内
+    """
+
+    def __init__(self, job_id, state, interval=1.0, persist=True):
+        self.job_id = job_id
+        self.state = state
+        self.interval = interval
+        self.persist = persist
+        self._last_flush = 0.0
+
+    def update(self, stage, count):
+        self.state[stage] = count
+        now = time.monotonic()
+        if self.persist and now - self._last_flush >= self.interval:
+            self.flush()
+            self._last_flush = now
+
+    def flush(self):
+        # 进度写入独立事务，不影响任务本身的事务
+        with db.engine.begin() as conn:
+            conn.execute(
+                BackgroundJob.__table__.update()
+                .where(BackgroundJob.__table__.c.id == self.job_id)
+                .values(progress=json.dumps(self.state, ensure_ascii=False), heartbeat_at=datetime.utcnow())
+            )
+
+
+def current_owner():
+    """当前进程的标识，fork 出的每个 worker 各不相同"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobRunner:
+    """进程内后台任务执行器"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.executor = None
+        self.live_progress = {}  # 本进程正在执行的任务进度
+        self._persisted = set()  # 本进程中需要写心跳的任务
+        self._lock = threading.Lock()
+        self._heartbeat_thread = None
+        self._last_reconcile = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['job_runner'] = self
+
+    def _get_executor(self):
+        # 延迟创建线程池，gunicorn --preload 时每个 worker fork 后各自创建
+        with self._lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.app.config.get('JOB_WORKERS', 2),
+                    thread_name_prefix='timeline-job'
+                )
+            if self._heartbeat_thread is None or not self._heartbeat_thread.is_alive():
+                self._heartbeat_thread = threading.Thread(target=self._heartbeat, name='timeline-job-heartbeat', daemon=True)
+                self._heartbeat_thread.start()
+            return self.executor
+
+    def _heartbeat(self):
+        # 只给进度写库的任务写心跳；SQLite 上的还原持有写锁，心跳写入会被阻塞，这类任务只按进程是否存活判断
+        interval = self.app.config.get('JOB_HEARTBEAT_INTERVAL', 10)
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                job_ids = list(self._persisted)
+            if not job_ids:
+                continue
+            try:
+                with self.app.app_context(), db.engine.begin() as conn:
+                    conn.execute(
+                        update(BackgroundJob)
+                        .where(BackgroundJob.id.in_(job_ids))
+                        .values(heartbeat_at=datetime.utcnow())
+                    )
+            except Exception:
+                traceback.print_exc()
+
+    def reconcile(self, force=False):
+        """
+        把执行进程已退出的 pending/running 任务标记为失败，按心跳间隔节流
+        写心跳的任务超过 JOB_STALE_TIMEOUT 没有心跳视为失败；
+        同一主机上的任务还检查进程是否存在（本进程的任务看是否仍在执行）
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_reconcile < self.app.config.get('JOB_HEARTBEAT_INTERVAL', 10):
+                return 0
+            self._last_reconcile = now
+
+        hostname = socket.gethostname()
+        stale_before = datetime.utcnow() - timedelta(seconds=self.app.config.get('JOB_STALE_TIMEOUT', 120))
+        rows = db.session.execute(
+            select(BackgroundJob.id, BackgroundJob.owner, BackgroundJob.heartbeat_at, BackgroundJob.progress_persisted)
+            .where(BackgroundJob.status.in_(('pending', 'running')))
+        ).all()
+
+        dead = []
+        for job_id, owner, heartbeat_at, persisted in rows:
+            if job_id in self.live_progress:
+                continue
+            is_dead = persisted and (heartbeat_at is None or heartbeat_at < stale_before)
+            host, _, pid = (owner or '').rpartition(':')
+            if host == hostname and pid.isdigit():
+                is_dead = is_dead or int(pid) == os.getpid() or not _process_alive(int(pid))
+            if is_dead:
+                dead.append(job_id)
+
+        if dead:
+            db.session.execute(
+                update(BackgroundJob)
+                .where(BackgroundJob.id.in_(dead), BackgroundJob.status.in_(('pending', 'running')))
+                .values(status='failed', error='执行任务的进程已退出，任务未完成', finished_at=datetime.utcnow())
+            )
+            db.session.commit()
+        return len(dead)
+
+    def submit(self, job_type, func, *args, created_by=None, persist_progress=True, **kwargs):
+        """
+        创建任务记录并提交执行，返回任务ID
+        func 在应用上下文中以 func(progress, *args, **kwargs) 调用，返回值作为任务结果保存
+        """
+        executor = self._get_executor()
+        job = BackgroundJob(
+            id=uuid.uuid4().hex,
+            job_type=job_type,
+            status='pending',
+            created_by=created_by,
+            owner=current_owner(),
+            heartbeat_at=datetime.utcnow(),
+            progress_persisted=persist_progress
+        )
+        # 提交前登记为本进程的任务，避免同进程的 reconcile 把刚创建的任务当作遗留任务
+        self.live_progress[job.id] = {}
+        if persist_progress:
+            with self._lock:
+                self._persisted.add(job.id)
+        db.session.add(job)
+        try:
+            db.session.commit()
+        except Exception:
+            self._forget(job.id)
+            raise
+
+        executor.submit(self._run, job.id, func, args, kwargs, persist_progress)
+        return job.id
+
+    def _forget(self, job_id):
+        self.live_progress.pop(job_id, None)
+        with self._lock:
+            self._persisted.discard(job_id)
+
+    def get_progress(self, job):
+        """优先返回本进程内的实时进度，其余情况使用数据库中的记录"""
+        if job.id in self.live_progress:
+            return dict(self.live_progress[job.id])
+        return json.loads(job.progress) if job.progress else {}
+
+    def _run(self, job_id, func, args, kwargs, persist_progress):
+        with self.app.app_context():
+            job = db.session.get(BackgroundJob, job_id)
+            job.status = 'running'
+            job.started_at = datetime.utcnow()
+            db.session.commit()
+
+            progress = JobProgress(
+                job_id,
+                self.live_progress.setdefault(job_id, {}),
+                interval=self.app.config.get('JOB_PROGRESS_INTERVAL', 1.0),
+                persist=persist_progress
+            )
+            try:
+                result = func(progress, *args, **kwargs)
+            except Exception as e:
+                db.session.rollback()
+                traceback.print_exc()
+                job = db.session.get(BackgroundJob, job_id)
+                job.status = 'failed'
+                job.error = str(e)
+            else:
+                job = db.session.get(BackgroundJob, job_id)
+                job.status = 'succeeded'
+                job.result = json.dumps(result, ensure_ascii=False)
+            finally:
+                job.progress = json.dumps(progress.state, ensure_ascii=False)
+                job.finished_at = datetime.utcnow()
+                db.session.commit()
+                db.session.remove()
+                self._forget(job_id)
+
+
+def serialize_job(job):
+    """任务记录转为接口返回格式"""
+    data = {
+        'id': job.id,
+        'job_type': job.job_type,
+        'status': job.status,
+        'progress': job_runner.get_progress(job),
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error,
+        'created_at': job.created_at.strftime('%Y-%m-%d %H:%M:%S') if job.created_at else None,
+        'started_at': job.started_at.strftime('%Y-%m-%d %H:%M:%S') if job.started_at else None,
+        'finished_at': job.finished_at.strftime('%Y-%m-%d %H:%M:%S') if job.finished_at else None,
+        'progress_persisted': job.progress_persisted
+    }
+    # 进度不写库的任务（SQLite 上的还原）在其他 worker 上查询时看不到实时进度
+    if job.status in ('pending', 'running') and not job.progress_persisted and job.id not in job_runner.live_progress:
+        data['progress_note'] = '该任务的进度只在执行它的进程内可见，完成后可查看完整进度'
+    return data
+
+
+job_runner = JobRunner()
@@ -0,0 +1,116 @@
+"""
+Timeline Notebook 关键词过滤匹配器
+基于 Aho-Corasick 自动机，一次线性扫描即可匹配全部敏感词
+"""
+
+import threading
+import time
+from collections import deque
+
+from models import KeywordFilter
+
+
+class KeywordMatcher:
+    """Aho-Corasick 多模式匹配自动机（大小写不敏感）"""
+
+    def __init__(self, keywords):
+        # 每个状态：转移表、失败指针、在该状态结束的关键词
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]
+        self.size = 0
+
+        for keyword in keywords:
+            self._add(keyword)
+        self._build_fail_links()
+
+    def _add(self, keyword):
+        normalized = keyword.lower()
+        if not normalized:
+            return
+
+        state = 0
+        for char in normalized:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+                self._goto[state][char] = next_state
+            state = next_state
+
+        # 重复关键词只保留第一次出现的原始写法
+        if self._output[state] is None:
+            self._output[state] = keyword
+            self.size += 1
+
+    def _build_fail_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                # 继承失败状态的输出，保证后缀关键词也能命中
+                if self._output[next_state] is None:
+                    self._output[next_state] = self._output[self._fail[next_state]]
+
+    def search(self, text):
+        """返回文本中最先出现的关键词，没有命中时返回 None"""
+        if not text or not self.size:
+            return None
+
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        state = 0
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state] is not None:
+                return output[state]
+        return None
+
+
+# 进程内缓存：关键词规则变更时递增版本号，匹配器在下次使用时重建
+_lock = threading.Lock()
+_version = 0
+_cached_matcher = None
+_cached_version = -1
+_cached_at = 0.0
+
+
+def bump_keyword_version():
+    """关键词规则被修改后调用，使缓存的匹配器失效"""
+    global _version
+    with _lock:
+        _version += 1
+
+
+def get_keyword_matcher(ttl=60):
+    """
+    获取当前生效的匹配器
+    版本号只在本进程内递增，ttl 用于让其他 worker 进程定期同步规则变更
+    """
+    global _cached_matcher, _cached_version, _cached_at
+
+    now = time.monotonic()
+    matcher = _cached_matcher
+    if matcher is not None and _cached_version == _version and now - _cached_at < ttl:
+        return matcher
+
+    with _lock:
+        if _cached_matcher is not None and _cached_version == _version and now - _cached_at < ttl:
+            return _cached_matcher
+
+        version = _version
+        keywords = [row.keyword for row in KeywordFilter.query.filter_by(is_active=True).order_by(KeywordFilter.id).all()]
+        _cached_matcher = KeywordMatcher(keywords)
+        _cached_version = version
+        _cached_at = now
+        return _cached_matcher
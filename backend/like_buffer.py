@@ -0,0 +1,221 @@
+"""
+Timeline Notebook 点赞写缓冲
+开启 LIKE_WRITE_BEHIND 后，点赞/取消点赞只记录在进程内缓冲中，
+由后台线程每隔 LIKE_FLUSH_INTERVAL_MS 毫秒合并为一个事务写入数据库；
+读取接口叠加本进程尚未写入的变化，用户能立即看到自己的点赞
+"""
+
+import atexit
+import threading
+import traceback
+
+from sqlalchemy import delete, func, select, update
+
+import counters
+import user_stats
+from message_events import publish_event
+from response_cache import invalidate
+from models import db, Message, MessageLike, TimelineEntry
+
+
+class LikeBuffer:
+    """进程内点赞缓冲，gunicorn 每个 worker 各有一份，其他 worker 在写入后才能看到变化"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        # (user_id, message_id) -> (最终是否点赞, 数据库中原本是否点赞)
+        self._message_likes = {}
+        # entry_id -> 待累加的点赞数
+        self._timeline_likes = {}
+        # 正在写入数据库、尚未提交的变化，读取时同样需要叠加
+        self._inflight_message_likes = {}
+        self._inflight_timeline_likes = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['like_buffer'] = self
+        atexit.register(self.flush)
+
+    def is_enabled(self):
+        return bool(self.app and self.app.config.get('LIKE_WRITE_BEHIND'))
+
+    def _ensure_thread(self):
+        # 延迟启动写入线程，gunicorn --preload 时每个 worker fork 后各自启动
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='like-buffer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        interval = self.app.config.get('LIKE_FLUSH_INTERVAL_MS', 200) / 1000
+        while True:
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def toggle_message_like(self, user_id, message_id):
+        """记录一次点赞/取消点赞，返回操作后是否为点赞状态"""
+        with self._lock:
+            pending = self._pending_state(user_id, message_id)
+        if pending is not None:
+            liked_now, liked_in_db = pending
+        else:
+            liked_in_db = db.session.execute(
+                select(MessageLike.id).where(MessageLike.user_id == user_id, MessageLike.message_id == message_id)
+            ).first() is not None
+            liked_now = liked_in_db
+
+        with self._lock:
+            # 重新读取缓冲，期间同一用户的并发请求已改变状态时以缓冲为准
+            liked_now, liked_in_db = self._pending_state(user_id, message_id) or (liked_now, liked_in_db)
+            liked = not liked_now
+            if liked == liked_in_db:
+                self._message_likes.pop((user_id, message_id), None)
+            else:
+                self._message_likes[(user_id, message_id)] = (liked, liked_in_db)
+            self._ensure_thread()
+        return liked
+
+    def _pending_state(self, user_id, message_id):
+        """返回 (当前是否点赞, 写入前数据库中是否点赞)，没有待写入的变化时返回 None"""
+        pending = self._message_likes.get((user_id, message_id))
+        if pending is not None:
+            return pending
+        inflight = self._inflight_message_likes.get((user_id, message_id))
+        if inflight is not None:
+            # 正在写入的变化提交后即为数据库状态
+            return inflight[0], inflight[0]
+        return None
+
+    def _iter_message_likes(self):
+        yield from self._inflight_message_likes.items()
+        yield from self._message_likes.items()
+
+    def add_timeline_like(self, entry_id):
+        with self._lock:
+            self._timeline_likes[entry_id] = self._timeline_likes.get(entry_id, 0) + 1
+            self._ensure_thread()
+
+    def message_delta(self, message_id):
+        """留言尚未写入的点赞数变化"""
+        return self.message_deltas([message_id]).get(message_id, 0)
+
+    def message_deltas(self, message_ids):
+        """批量获取留言尚未写入的点赞数变化，返回 {message_id: 变化量}"""
+        message_ids = set(message_ids)
+        deltas = {}
+        with self._lock:
+            for (_, message_id), (liked, liked_in_db) in self._iter_message_likes():
+                if message_id in message_ids and liked != liked_in_db:
+                    deltas[message_id] = deltas.get(message_id, 0) + (1 if liked else -1)
+        return deltas
+
+    def user_liked(self, user_id, message_id):
+        """用户对留言尚未写入的点赞状态，没有待写入的变化时返回 None"""
+        with self._lock:
+            pending = self._pending_state(user_id, message_id)
+        return pending[0] if pending else None
+
+    def timeline_delta(self, entry_id):
+        with self._lock:
+            return self._timeline_likes.get(entry_id, 0) + self._inflight_timeline_likes.get(entry_id, 0)
+
+    def flush(self):
+        """把缓冲中的变化合并为一个事务写入数据库，失败时放回缓冲等待下次重试"""
+        # 同一时间只允许一次写入
+        with self._flush_lock:
+            with self._lock:
+                message_likes, self._message_likes = self._message_likes, {}
+                timeline_likes, self._timeline_likes = self._timeline_likes, {}
+                self._inflight_message_likes = message_likes
+                self._inflight_timeline_likes = timeline_likes
+            if not message_likes and not timeline_likes:
+                return
+
+            with self.app.app_context():
+                try:
+                    self._write(message_likes, timeline_likes)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    traceback.print_exc()
+                    self._requeue(message_likes, timeline_likes)
+                finally:
+                    with self._lock:
+                        self._inflight_message_likes = {}
+                        self._inflight_timeline_likes = {}
+                    db.session.remove()
+
+    def _write(self, message_likes, timeline_likes):
+        added = [(user_id, message_id) for (user_id, message_id), (liked, _) in message_likes.items() if liked]
+        removed = [(user_id, message_id) for (user_id, message_id), (liked, _) in message_likes.items() if not liked]
+        message_ids = {message_id for _, message_id in message_likes}
+
+        # 只保留仍然存在的留言，期间被删除的留言上的点赞直接丢弃
+        if message_ids:
+            message_ids = set(db.session.execute(select(Message.id).where(Message.id.in_(message_ids))).scalars())
+        added = [key for key in added if key[1] in message_ids]
+        removed = [key for key in removed if key[1] in message_ids]
+
+        # 取消的点赞按留言分组批量删除
+        removed_by_message = {}
+        for user_id, message_id in removed:
+            removed_by_message.setdefault(message_id, []).append(user_id)
+        for message_id, user_ids in removed_by_message.items():
+            db.session.execute(
+                delete(MessageLike).where(MessageLike.message_id == message_id, MessageLike.user_id.in_(user_ids))
+            )
+        if added:
+            existing = set(db.session.execute(
+                select(MessageLike.user_id, MessageLike.message_id).where(
+                    MessageLike.message_id.in_({message_id for _, message_id in added}),
+                    MessageLike.user_id.in_({user_id for user_id, _ in added})
+                )
+            ).tuples())
+            rows = [{'user_id': user_id, 'message_id': message_id}
+                    for user_id, message_id in added if (user_id, message_id) not in existing]
+            if rows:
+                db.session.execute(MessageLike.__table__.insert(), rows)
+
+        if message_ids:
+            # 按点赞表重新计算受影响留言的点赞数及作者的获赞数，一条语句完成
+            like_count = select(func.count(MessageLike.id)).where(
+                MessageLike.message_id == Message.id
+            ).scalar_subquery()
+            db.session.execute(
+                update(Message).where(Message.id.in_(message_ids)).values(like_count=like_count),
+                execution_options={'synchronize_session': False}
+            )
+            rows = db.session.execute(
+                select(Message.id, Message.user_id, Message.like_count).where(Message.id.in_(message_ids))
+            ).all()
+            user_stats.rebuild_user_stats(list({user_id for _, user_id, _ in rows}))
+            invalidate('messages')
+            # 每条留言发布一次写入后的点赞数，和点赞一起提交
+            for message_id, _, like_count in rows:
+                publish_event('message_liked', {'id': message_id, 'like_count': like_count})
+
+        for entry_id, delta in timeline_likes.items():
+            counters.increment(TimelineEntry.likes, TimelineEntry.id == entry_id, delta)
+
+    def _requeue(self, message_likes, timeline_likes):
+        with self._lock:
+            for key, (liked, liked_in_db) in message_likes.items():
+                # 写入失败期间又有新的操作时，以新的操作为准，但数据库状态仍是写入前的状态
+                newer = self._message_likes.get(key)
+                if newer is not None:
+                    liked = newer[0]
+                if liked == liked_in_db:
+                    self._message_likes.pop(key, None)
+                else:
+                    self._message_likes[key] = (liked, liked_in_db)
+            for entry_id, delta in timeline_likes.items():
+                self._timeline_likes[entry_id] = self._timeline_likes.get(entry_id, 0) + delta
+
+
+like_buffer = LikeBuffer()
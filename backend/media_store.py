@@ -0,0 +1,265 @@
+"""
+Timeline Notebook 上传文件存储
+按内容 SHA-256 寻址，分片目录 ab/cd/<sha256>.<ext> 保存，相同文件只存一份；
+media_path、image_url、avatar_url 引用同一文件时共享引用计数，计数归零后才删除文件。
+上传的临时文件保留到事务结束：提交时目标文件若已被并发的删除移走则用它补回，回滚时删除本事务新放入且没有记录引用的文件
+"""
+
+import hashlib
+import os
+import re
+import uuid
+
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from commit_hooks import on_outer_commit
+from models import db, MediaBlob, TimelineEntry, TimeCapsule, MessageImage, User
+
+CHUNK_SIZE = 64 * 1024
+BLOB_PATH_PATTERN = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(\.[0-9a-z]+)?$')
+
+
+# 旧版以 uuid 命名的上传文件，如 message_<32位十六进制>.png、avatar_1_<32位十六进制>.png
+LEGACY_UUID_PATTERN = re.compile(r'^[a-z]+_(?:\d+_)?[0-9a-f]{32}\.[0-9a-z]+$')
+
+
+def get_upload_folder():
+    upload_folder = current_app.config.get('UPLOAD_FOLDER')
+    if not os.path.isabs(upload_folder):
+        upload_folder = os.path.join(current_app.root_path, upload_folder)
+    return upload_folder
+
+
+def blob_path(digest, file_ext):
+    """分片存储路径，避免单个目录下文件过多"""
+    suffix = f'.{file_ext}' if file_ext else ''
+    return f'{digest[:2]}/{digest[2:4]}/{digest}{suffix}'
+
+
+def path_from_url(url):
+    """从 /static/uploads/... 形式的地址中取出相对上传目录的路径"""
+    if not url or 'uploads/' not in url:
+        return None
+    return url.split('uploads/', 1)[1]
+
+
+def content_etag(relative_path):
+    """内容寻址文件（及其衍生图）的强ETag即内容哈希，其他文件返回 None"""
+    if relative_path.startswith('_variants/'):
+        variant, _, relative_path = relative_path[len('_variants/'):].partition('/')
+        match = BLOB_PATH_PATTERN.match(relative_path)
+        return f'{match.group(1)}-{variant}' if match else None
+    match = BLOB_PATH_PATTERN.match(relative_path)
+    return match.group(1) if match else None
+
+
+def is_immutable_path(relative_path):
+    """文件名由内容哈希或 uuid 决定的上传文件内容不会变化，可以长期缓存"""
+    return content_etag(relative_path) is not None or bool(LEGACY_UUID_PATTERN.match(relative_path))
+
+
+def save_upload(file, file_ext):
+    """
+    保存上传文件并增加引用计数，返回相对上传目录的路径
+    边读取边计算哈希写入临时文件，内容不存在时以硬链接放入分片目录；临时文件在事务结束时处理
+    """
+    upload_folder = get_upload_folder()
+    os.makedirs(upload_folder, exist_ok=True)
+
+    tmp_path = os.path.join(upload_folder, f'.upload_{uuid.uuid4().hex}')
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, 'wb') as fp:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha256.update(chunk)
+                fp.write(chunk)
+                size += len(chunk)
+        os.chmod(tmp_path, 0o644)
+
+        digest = sha256.hexdigest()
+        relative_path = _acquire(digest, blob_path(digest, file_ext), size)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    target_path = os.path.join(upload_folder, relative_path)
+    placed = False
+    if not os.path.exists(target_path):
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        try:
+            os.link(tmp_path, target_path)
+            placed = True
+        except FileExistsError:
+            pass
+    db.session.info.setdefault('media_uploads', []).append((digest, tmp_path, target_path, placed))
+    return relative_path
+
+
+def get_size(relative_path):
+    return os.path.getsize(os.path.join(get_upload_folder(), relative_path))
+
+
+def _acquire(digest, path, size):
+    """引用计数加一（原子更新），内容首次出现时创建记录，返回实际存储路径"""
+    result = db.session.execute(
+        update(MediaBlob).where(MediaBlob.sha256 == digest).values(ref_count=MediaBlob.ref_count + 1)
+    )
+    if result.rowcount == 0:
+        try:
+            with db.session.begin_nested():
+                db.session.add(MediaBlob(sha256=digest, path=path, size=size, ref_count=1))
+        except IntegrityError:
+            # 并发上传同一内容，另一请求已创建记录
+            db.session.execute(
+                update(MediaBlob).where(MediaBlob.sha256 == digest).values(ref_count=MediaBlob.ref_count + 1)
+            )
+    return db.session.execute(select(MediaBlob.path).where(MediaBlob.sha256 == digest)).scalar_one()
+
+
+def release(relative_path):
+    """
+    释放一次引用；计数归零时在事务提交后删除文件
+    兼容去重之前以 uuid 命名的旧文件：没有引用记录的直接删除
+    """
+    if not relative_path:
+        return
+
+    match = BLOB_PATH_PATTERN.match(relative_path)
+    if not match:
+        _unlink_after_commit(relative_path)
+        return
+
+    digest = match.group(1)
+    db.session.execute(
+        update(MediaBlob).where(MediaBlob.sha256 == digest).values(ref_count=MediaBlob.ref_count - 1)
+    )
+    blob = db.session.get(MediaBlob, digest, populate_existing=True)
+    if blob is not None and blob.ref_count <= 0:
+        db.session.delete(blob)
+        _unlink_after_commit(blob.path)
+
+
+def _unlink_after_commit(relative_path):
+    from image_variants import VARIANTS, is_image, variant_path
+
+    upload_folder = get_upload_folder()
+    match = BLOB_PATH_PATTERN.match(relative_path)
+    # 图片的衍生尺寸随原图一起删除（再次请求时重新生成）
+    variants = []
+    if is_image(relative_path):
+        variants = [os.path.join(upload_folder, variant_path(relative_path, variant)) for variant in VARIANTS]
+    db.session.info.setdefault('media_unlink', []).append(
+        (match.group(1) if match else None, os.path.join(upload_folder, relative_path), variants)
+    )
+
+
+def _blob_exists(digest):
+    # 在事务结束的回调中使用独立连接查询
+    with db.engine.connect() as conn:
+        return conn.execute(select(MediaBlob.sha256).where(MediaBlob.sha256 == digest)).first() is not None
+
+
+def _remove_unreferenced(digest, file_path, variants=()):
+    """
+    删除没有记录引用的分片文件
+    先把文件移开再检查记录：并发上传同一内容的事务若已提交记录则放回；
+    若在移开之后才提交，它在提交后发现文件缺失，会用自己保留的临时文件补回
+    """
+    if digest is None:
+        for path in (file_path, *variants):
+            if os.path.exists(path):
+                os.remove(path)
+        return
+
+    removed_path = f'{file_path}.removed_{uuid.uuid4().hex}'
+    try:
+        os.rename(file_path, removed_path)
+    except FileNotFoundError:
+        return
+    if _blob_exists(digest):
+        try:
+            os.link(removed_path, file_path)
+        except FileExistsError:
+            pass
+        os.remove(removed_path)
+        return
+    os.remove(removed_path)
+    for path in variants:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _finish_uploads(uploads):
+    """提交后：目标文件被并发的删除移走时用保留的临时文件补回"""
+    for digest, tmp_path, target_path, _ in uploads:
+        if not os.path.exists(target_path):
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            try:
+                os.link(tmp_path, target_path)
+            except FileExistsError:
+                pass
+        os.remove(tmp_path)
+
+
+def _discard_uploads(uploads):
+    """回滚后：删除临时文件，以及本事务新放入且没有记录引用的文件"""
+    for digest, tmp_path, target_path, placed in uploads:
+        os.remove(tmp_path)
+        if placed:
+            _remove_unreferenced(digest, target_path)
+
+
+def _unlink_released_files(released):
+    for digest, file_path, variants in released:
+        _remove_unreferenced(digest, file_path, variants)
+
+
+# 先处理上传再删除释放的文件；保存点回滚（如 _acquire 中的并发插入）不影响已排队的文件
+on_outer_commit('media_uploads', _finish_uploads, on_rollback=_discard_uploads)
+on_outer_commit('media_unlink', _unlink_released_files)
+
+
+def rebuild_ref_counts():
+    """
+    根据 media_path、image_url、avatar_url 重新统计引用计数（数据还原后调用）
+    磁盘上存在但没有记录的分片文件会补建记录
+    """
+    counts = {}
+
+    def add(relative_path):
+        match = BLOB_PATH_PATTERN.match(relative_path or '')
+        if match:
+            counts[relative_path] = counts.get(relative_path, 0) + 1
+
+    for (path,) in db.session.execute(select(TimelineEntry.media_path).where(TimelineEntry.media_path.isnot(None))):
+        add(path)
+    for (path,) in db.session.execute(select(TimeCapsule.media_path).where(TimeCapsule.media_path.isnot(None))):
+        add(path)
+    for (path,) in db.session.execute(select(MessageImage.image_url)):
+        add(path)
+    for (url,) in db.session.execute(select(User.avatar_url).where(User.avatar_url.isnot(None))):
+        add(path_from_url(url))
+
+    upload_folder = get_upload_folder()
+    blobs = {blob.sha256: blob for blob in MediaBlob.query.all()}
+    for relative_path, count in counts.items():
+        digest = BLOB_PATH_PATTERN.match(relative_path).group(1)
+        blob = blobs.pop(digest, None)
+        if blob is None:
+            file_path = os.path.join(upload_folder, relative_path)
+            if not os.path.exists(file_path):
+                continue
+            blob = MediaBlob(sha256=digest, path=relative_path, size=os.path.getsize(file_path))
+            db.session.add(blob)
+        blob.ref_count = count
+
+    # 不再被引用的记录保留文件，只把计数清零，避免误删仍在别处使用的内容
+    for blob in blobs.values():
+        blob.ref_count = 0
+    return len(counts)
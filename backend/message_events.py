@@ -0,0 +1,229 @@
+"""
+Timeline Notebook 留言墙事件推送
+发布留言、点赞、评论时把事件写入 message_events 表（与业务数据同一事务），
+每个 worker 由一个后台线程轮询新事件放入进程内环形缓冲，/api/messages/stream 以 SSE 推送给本进程的订阅者；
+事件ID即表的主键，各 worker 一致，客户端断线重连到任意 worker 时携带 Last-Event-ID 即可补齐错过的事件
+"""
+
+import json
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select
+
+from commit_hooks import on_outer_commit
+from models import db, MessageEvent
+
+# 事件ID不连续时等待的秒数：较小的ID可能属于尚未提交的事务，超时后视为已回滚的空号
+GAP_TIMEOUT = 2.0
+# 清理过期事件的间隔（秒）
+PRUNE_INTERVAL = 60
+POLL_BATCH_SIZE = 500
+
+
+class MessageEventBroker:
+    """
+    进程内事件分发，gunicorn 每个 worker 各有一份，事件来源是所有 worker 共享的 message_events 表
+    每个 worker 同时打开的事件流数量有上限，每个事件流占用一个 gthread 线程，超出时接口返回 503
+    """
+
+    def __init__(self, buffer_size=1000):
+        self.app = None
+        self._condition = threading.Condition()
+        self._events = deque(maxlen=buffer_size)  # (事件ID, 类型, 数据)
+        self._cursor = None  # 已读入缓冲的最大事件ID
+        self._dropped_upto = 0  # 不在缓冲中的事件的最大ID（启动前的事件和被环形缓冲覆盖的事件）
+        self._gap_since = None
+        self._streams = 0
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._last_prune = 0.0
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['message_events'] = self
+        with self._condition:
+            self._events = deque(self._events, maxlen=app.config.get('MESSAGE_STREAM_BUFFER_SIZE', 1000))
+
+    def notify(self):
+        """本进程写入了新事件，立即轮询一次"""
+        self._wakeup.set()
+
+    def _ensure_started(self):
+        # 延迟启动轮询线程，gunicorn --preload 时每个 worker fork 后各自启动；
+        # 起点为当前最大事件ID，更早的事件在客户端重连时按需从表中读取
+        with self._condition:
+            if self._cursor is None:
+                self._cursor = db.session.execute(select(func.max(MessageEvent.id))).scalar() or 0
+                self._dropped_upto = self._cursor
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='message-events', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        interval = self.app.config.get('MESSAGE_STREAM_POLL_INTERVAL', 1.0)
+        while True:
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            with self.app.app_context():
+                try:
+                    self.poll()
+                    if time.monotonic() - self._last_prune >= PRUNE_INTERVAL:
+                        self.prune()
+                except Exception:
+                    db.session.rollback()
+                    traceback.print_exc()
+                finally:
+                    db.session.remove()
+
+    def poll(self):
+        """读取新事件放入缓冲并唤醒等待中的事件流"""
+        rows = db.session.execute(
+            select(MessageEvent.id, MessageEvent.event_type, MessageEvent.data)
+            .where(MessageEvent.id > self._cursor)
+            .order_by(MessageEvent.id)
+            .limit(POLL_BATCH_SIZE)
+        ).all()
+
+        received = []
+        cursor = self._cursor
+        for event_id, event_type, data in rows:
+            if event_id != cursor + 1:
+                now = time.monotonic()
+                if self._gap_since is None:
+                    self._gap_since = now
+                if now - self._gap_since < GAP_TIMEOUT:
+                    break
+            self._gap_since = None
+            received.append((event_id, event_type, json.loads(data)))
+            cursor = event_id
+
+        if not received:
+            return
+        with self._condition:
+            for item in received:
+                if len(self._events) == self._events.maxlen:
+                    self._dropped_upto = self._events[0][0]
+                self._events.append(item)
+            self._cursor = cursor
+            self._condition.notify_all()
+
+    def prune(self):
+        retention = self.app.config.get('MESSAGE_EVENT_RETENTION', 3600)
+        db.session.execute(delete(MessageEvent).where(
+            MessageEvent.created_at < datetime.utcnow() - timedelta(seconds=retention)
+        ))
+        db.session.commit()
+        self._last_prune = time.monotonic()
+
+    def try_acquire_stream(self):
+        """占用一个事件流名额，本进程的事件流已满时返回 False"""
+        limit = self.app.config.get('MESSAGE_STREAM_MAX_CONNECTIONS', 8) if self.app else 8
+        with self._condition:
+            if self._streams >= limit:
+                return False
+            self._streams += 1
+            return True
+
+    def release_stream(self):
+        with self._condition:
+            self._streams -= 1
+
+    def _load_backlog(self, last_id, upto):
+        """从表中读取 (last_id, upto] 之间的事件；已被清理或数量超过缓冲大小时返回 None"""
+        oldest = db.session.execute(select(func.min(MessageEvent.id))).scalar()
+        if oldest is None or oldest > last_id + 1:
+            return None
+        rows = db.session.execute(
+            select(MessageEvent.id, MessageEvent.event_type, MessageEvent.data)
+            .where(MessageEvent.id > last_id, MessageEvent.id <= upto)
+            .order_by(MessageEvent.id)
+            .limit(self._events.maxlen + 1)
+        ).all()
+        if len(rows) > self._events.maxlen:
+            return None
+        return [(event_id, event_type, json.loads(data)) for event_id, event_type, data in rows]
+
+    @staticmethod
+    def format_event(event_id, event_type, data):
+        payload = json.dumps(data, ensure_ascii=False, default=str)
+        return f'id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n'
+
+    def stream(self, last_event_id=None, heartbeat=15, max_duration=None):
+        """
+        返回 SSE 文本流：先补发 Last-Event-ID 之后的事件，再等待新事件
+        补发部分在请求上下文中读取，返回的生成器只读取进程内缓冲，不访问数据库
+        无事件时每 heartbeat 秒发送注释行保活；max_duration 秒后结束，客户端自动重连
+        """
+        self._ensure_started()
+
+        # 建议客户端断线 3 秒后重连
+        initial = ['retry: 3000\n\n']
+        with self._condition:
+            cursor, dropped_upto = self._cursor, self._dropped_upto
+        seq = cursor
+
+        if last_event_id:
+            last_id = int(last_event_id) if str(last_event_id).isdigit() else None
+            backlog = None
+            if last_id is not None and last_id <= cursor:
+                if last_id >= dropped_upto:
+                    backlog, seq = [], last_id
+                else:
+                    backlog = self._load_backlog(last_id, dropped_upto)
+                    seq = dropped_upto
+            if backlog is None:
+                # 无法补齐，通知客户端重新拉取列表
+                initial.append(self.format_event(cursor, 'reset', {}))
+                seq = cursor
+            else:
+                initial.extend(self.format_event(*item) for item in backlog)
+
+        return self._generate(initial, seq, heartbeat, max_duration)
+
+    def _generate(self, initial, seq, heartbeat, max_duration):
+        deadline = time.monotonic() + max_duration if max_duration else None
+        yield from initial
+
+        while deadline is None or time.monotonic() < deadline:
+            with self._condition:
+                # 等待期间环形缓冲已覆盖了未发送的事件
+                overrun = seq < self._dropped_upto
+                if overrun:
+                    seq = self._cursor
+            if overrun:
+                yield self.format_event(seq, 'reset', {})
+                continue
+
+            with self._condition:
+                pending = [item for item in self._events if item[0] > seq]
+                if not pending:
+                    timeout = heartbeat if deadline is None else max(0, min(heartbeat, deadline - time.monotonic()))
+                    self._condition.wait(timeout)
+                    pending = [item for item in self._events if item[0] > seq]
+
+            if not pending:
+                yield ': keepalive\n\n'
+                continue
+            for item in pending:
+                yield self.format_event(*item)
+                seq = item[0]
+
+
+def publish_event(event_type, data):
+    """随当前事务写入事件，提交后各 worker 的订阅者都会收到，事务回滚则不发布"""
+    db.session.add(MessageEvent(event_type=event_type, data=json.dumps(data, ensure_ascii=False, default=str)))
+    db.session.info['message_events_written'] = True
+
+
+def _notify_broker(_):
+    broker.notify()
+
+
+on_outer_commit('message_events_written', _notify_broker)
+
+
+broker = MessageEventBroker()
@@ -0,0 +1,34 @@
+"""
+升级时间胶囊答案哈希
+把旧版无盐 SHA-256 答案哈希包裹为加盐 PBKDF2，无需知道原答案；
+包裹后的哈希在下次答对时会再升级为直接对答案计算的格式
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from config import config
+from models import db, TimeCapsule
+from hashing import is_legacy_hash, wrap_legacy_hash
+
+
+def migrate_capsule_answers():
+    app = Flask(__name__)
+    config_name = os.environ.get('FLASK_ENV', 'production')
+    app.config.from_object(config.get(config_name, config['production']))
+    db.init_app(app)
+
+    with app.app_context():
+        migrated = 0
+        for capsule in TimeCapsule.query.all():
+            if is_legacy_hash(capsule.answer_hash):
+                capsule.answer_hash = wrap_legacy_hash(capsule.answer_hash)
+                migrated += 1
+        db.session.commit()
+        print(f"✅ 已升级 {migrated} 个时间胶囊的答案哈希")
+
+
+if __name__ == '__main__':
+    migrate_capsule_answers()
@@ -1,9 +1,16 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
-import hashlib
+from hashing import hash_answer, verify_answer, answer_needs_rehash, get_password_method, hash_password, verify_password
+from db_routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+def ensure_indexes():
+    """为已存在的表补建模型中新增的索引（create_all 不会给旧表加索引）"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
 
 class TimelineEntry(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -14,6 +21,9 @@ class TimelineEntry(db.Model):
     media_path = db.Column(db.String(255), nullable=True)
     likes = db.Column(db.Integer, default=0)
 
+    # 游标分页按 (created_at, id) 倒序扫描，复合索引保证任意页的代价与首页相同
+    __table_args__ = (db.Index('ix_timeline_entry_created_at_id', 'created_at', 'id'),)
+
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
@@ -35,11 +45,12 @@ class User(db.Model):
     last_login = db.Column(db.DateTime, nullable=True)  # 最后登录时间
     login_count = db.Column(db.Integer, default=0)  # 登录次数
 
+    # 在当前线程计算哈希，供脚本使用；接口请求通过 password_pool 在进程池中计算
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password, get_password_method())
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password, get_password_method())[0]
     
     def get_avatar_url(self):
         """获取用户头像URL，如果没有上传头像则返回默认头像"""
@@ -62,27 +73,31 @@ class TimeCapsule(db.Model):
     is_unlocked = db.Column(db.Boolean, default=False)  # 是否已解锁
     unlock_attempts = db.Column(db.Integer, default=0)  # 解锁尝试次数
     
+    # 按解锁时间筛选状态、查询下一个到期的胶囊都以 unlock_date 范围查询
+    __table_args__ = (db.Index('ix_time_capsule_unlock_date', 'unlock_date'),)
+    
     def set_answer(self, answer):
-        """设置胶囊答案"""
-        # 将答案转为小写并去除首尾空格，提高匹配成功率
-        normalized_answer = answer.strip().lower()
-        self.answer_hash = hashlib.sha256(normalized_answer.encode()).hexdigest()
+        """设置胶囊答案（加盐 PBKDF2，答案先转小写并去除首尾空格）"""
+        self.answer_hash = hash_answer(answer)
     
     def check_answer(self, answer):
-        """验证胶囊答案"""
-        # 同样进行标准化处理
-        normalized_answer = answer.strip().lower()
-        return self.answer_hash == hashlib.sha256(normalized_answer.encode()).hexdigest()
+        """验证胶囊答案（常量时间比较），旧格式的哈希在验证通过后升级"""
+        if not verify_answer(self.answer_hash, answer):
+            return False
+        if answer_needs_rehash(self.answer_hash):
+            self.set_answer(answer)
+        return True
     
-    def can_unlock(self):
-        """检查是否可以解锁（时间是否到达）"""
-        return datetime.utcnow() >= self.unlock_date
+    def can_unlock(self, now=None):
+        """检查是否可以解锁（时间是否到达），批量判断时传入同一个 now"""
+        return (now or datetime.utcnow()) >= self.unlock_date
     
-    def get_remaining_time(self):
+    def get_remaining_time(self, now=None):
         """获取剩余时间（秒）"""
-        if self.can_unlock():
+        now = now or datetime.utcnow()
+        if self.can_unlock(now):
             return 0
-        return int((self.unlock_date - datetime.utcnow()).total_seconds())
+        return int((self.unlock_date - now).total_seconds())
 
 
 # 留言墙相关模型
@@ -160,4 +175,54 @@ class KeywordFilter(db.Model):
     keyword = db.Column(db.String(100), nullable=False)
     type = db.Column(db.String(20), default='blacklist')  # blacklist, sensitive
     is_active = db.Column(db.Boolean, default=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class BackgroundJob(db.Model):
+    """后台任务模型（备份、还原等耗时操作）"""
+    __tablename__ = 'background_jobs'
+    
+    id = db.Column(db.String(32), primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False)  # backup, restore
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, succeeded, failed
+    progress = db.Column(db.Text, nullable=True)  # JSON，各阶段进度
+    result = db.Column(db.Text, nullable=True)  # JSON，任务结果
+    error = db.Column(db.Text, nullable=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    owner = db.Column(db.String(255), nullable=True)  # 执行任务的进程，主机名:pid
+    heartbeat_at = db.Column(db.DateTime, nullable=True)  # 执行进程最近一次心跳
+    progress_persisted = db.Column(db.Boolean, nullable=False, default=True)  # 进度是否写入数据库
+
+
+class MediaBlob(db.Model):
+    """内容寻址的上传文件，相同内容只存储一份，按引用计数回收"""
+    __tablename__ = 'media_blobs'
+    
+    sha256 = db.Column(db.String(64), primary_key=True)
+    path = db.Column(db.String(255), nullable=False)  # 相对上传目录的路径，如 ab/cd/<sha256>.png
+    size = db.Column(db.Integer, nullable=False, default=0)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class UserStats(db.Model):
+    """用户计数（冗余维护），由留言、评论、点赞的增删路径在同一事务内更新"""
+    __tablename__ = 'user_stats'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    message_count = db.Column(db.Integer, nullable=False, default=0)  # 发布的留言数
+    comment_count = db.Column(db.Integer, nullable=False, default=0)  # 发表的留言评论数
+    like_count = db.Column(db.Integer, nullable=False, default=0)  # 留言获得的点赞数
+
+
+class MessageEvent(db.Model):
+    """留言墙事件日志，各 worker 轮询读取后推送给本进程的 SSE 订阅者，过期后清理"""
+    __tablename__ = 'message_events'
+    
+    id = db.Column(db.Integer, primary_key=True)  # 即 SSE 事件ID，断线重连时按 Last-Event-ID 补发
+    event_type = db.Column(db.String(50), nullable=False)  # message_created, message_liked, message_commented, message_deleted
+    data = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
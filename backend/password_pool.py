@@ -0,0 +1,120 @@
+"""
+Timeline Notebook 密码哈希进程池
+scrypt/PBKDF2 每次需要数十到数百毫秒 CPU，放在请求线程里会在登录高峰占满 worker 并阻塞同进程的其他线程；
+哈希和验证提交到有界进程池执行，排队已满或等待超时时抛出 PasswordPoolBusy，由接口返回 503 和 Retry-After
+"""
+
+import multiprocessing
+import sys
+import threading
+import types
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from hashing import DEFAULT_PASSWORD_METHOD, hash_password, resolve_password_method, verify_password
+
+
+@contextmanager
+def _without_main_module():
+    """
+    spawn 启动的子进程会以 __mp_main__ 的名义重新执行主模块（python app.py 时即 app.py 及其中的建表等启动逻辑）；
+    启动子进程期间换成空的 __main__，子进程只导入任务函数所在的 hashing 模块
+    """
+    main_module = sys.modules['__main__']
+    sys.modules['__main__'] = types.ModuleType('__main__')
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main_module
+
+
+class PasswordPoolBusy(Exception):
+    """进程池已满，retry_after 为建议客户端等待的秒数"""
+
+    def __init__(self, retry_after):
+        super().__init__('密码哈希进程池繁忙')
+        self.retry_after = retry_after
+
+
+class PasswordPool:
+    def __init__(self, app=None):
+        self.app = None
+        self.executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['password_pool'] = self
+        self.workers = app.config.get('PASSWORD_POOL_WORKERS', 2)
+        self.timeout = app.config.get('PASSWORD_POOL_TIMEOUT', 10)
+        self.retry_after = app.config.get('PASSWORD_POOL_RETRY_AFTER', 1)
+        # 启动时补全一次哈希参数，验证时直接和已存哈希的前缀比较
+        self.method = resolve_password_method(app.config.get('PASSWORD_HASH_METHOD', DEFAULT_PASSWORD_METHOD))
+        # 正在执行和排队的任务总数上限
+        self._slots = threading.BoundedSemaphore(self.workers + app.config.get('PASSWORD_POOL_QUEUE_DEPTH', 16))
+
+    def _get_executor(self):
+        # 延迟创建进程池，gunicorn --preload 时每个 worker fork 后各自创建；
+        # 子进程用 spawn 启动，不继承 worker 中的线程和数据库连接
+        with self._lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self.executor
+
+    def _submit(self, executor, func, *args):
+        # 进程池在提交任务时按需启动子进程
+        with self._lock, _without_main_module():
+            return executor.submit(func, *args)
+
+    def _reset_executor(self, executor):
+        with self._lock:
+            if self.executor is executor:
+                self.executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _call(self, func, *args):
+        # 未配置进程池时在当前线程计算（开发环境、测试）
+        if not self.workers:
+            return func(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise PasswordPoolBusy(self.retry_after)
+
+        executor = self._get_executor()
+        try:
+            future = self._submit(executor, func, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._reset_executor(executor)
+            raise PasswordPoolBusy(self.retry_after)
+        except Exception:
+            self._slots.release()
+            raise
+        # 任务结束时才归还名额，等待超时的任务仍然计入排队数
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise PasswordPoolBusy(self.retry_after)
+        except BrokenProcessPool:
+            self._reset_executor(executor)
+            raise PasswordPoolBusy(self.retry_after)
+
+    def hash(self, password):
+        return self._call(hash_password, password, self.method)
+
+    def verify(self, stored_hash, password):
+        """返回 (是否正确, 新哈希)，哈希参数已过期时新哈希不为 None"""
+        return self._call(verify_password, stored_hash, password, self.method)
+
+
+password_pool = PasswordPool()
@@ -0,0 +1,130 @@
+"""
+Timeline Notebook 权限解析
+permissions / user_permissions 表中的权限按 ID 映射为位，每个用户的权限集合合并为一个整数位图，
+在进程内缓存（TTL），接口用 permission_required 按位判断，不产生额外查询。
+管理员角色拥有全部权限；修改用户权限的事务提交后立即清除本进程的缓存，其他 worker 最迟在 TTL 到期后生效
+"""
+
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, jsonify, session
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from commit_hooks import on_outer_commit
+from models import db
+
+
+class PermissionCache:
+    def __init__(self, app=None):
+        self.app = None
+        self.ttl = 60
+        self.max_size = 10000
+        self._catalog = None  # (权限名 -> 位, 过期时间)
+        self._user_bits = {}  # user_id -> (位图, 过期时间)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['permission_cache'] = self
+        self.ttl = app.config.get('PERMISSION_CACHE_TTL', 60)
+        self.max_size = app.config.get('PERMISSION_CACHE_MAX_SIZE', 10000)
+
+    def _fetch(self, sql, params=None):
+        # 使用独立连接，查询失败（如旧库没有权限表）不影响请求的会话事务
+        try:
+            with db.engine.connect() as conn:
+                return conn.execute(text(sql), params or {}).fetchall()
+        except SQLAlchemyError as e:
+            current_app.logger.warning(f'读取权限表失败: {e}')
+            return []
+
+    def catalog(self):
+        """权限名到位的映射"""
+        now = time.monotonic()
+        with self._lock:
+            if self._catalog is not None and self._catalog[1] >= now:
+                return self._catalog[0]
+
+        rows = self._fetch('SELECT id, name FROM permissions')
+        catalog = {name: 1 << permission_id for permission_id, name in rows}
+        with self._lock:
+            self._catalog = (catalog, now + self.ttl)
+        return catalog
+
+    def user_bits(self, user_id):
+        """用户拥有的权限位图"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._user_bits.get(user_id)
+            if entry is not None and entry[1] >= now:
+                return entry[0]
+
+        rows = self._fetch('SELECT permission_id FROM user_permissions WHERE user_id = :user_id', {'user_id': user_id})
+        bits = 0
+        for (permission_id,) in rows:
+            bits |= 1 << permission_id
+        with self._lock:
+            self._user_bits[user_id] = (bits, now + self.ttl)
+            # 超过上限时清理过期条目
+            if len(self._user_bits) > self.max_size:
+                self._user_bits = {key: value for key, value in self._user_bits.items() if value[1] >= now}
+        return bits
+
+    def mask(self, *names):
+        """权限名对应的位掩码，包含不存在的权限名时返回 None"""
+        catalog = self.catalog()
+        mask = 0
+        for name in names:
+            if name not in catalog:
+                return None
+            mask |= catalog[name]
+        return mask
+
+    def discard(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._user_bits.pop(user_id, None)
+
+
+def has_permission(*names):
+    """当前登录用户是否同时拥有所有给定权限，管理员始终拥有"""
+    if 'user_id' not in session:
+        return False
+    if session.get('role') == 'admin':
+        return True
+    mask = permission_cache.mask(*names)
+    return mask is not None and permission_cache.user_bits(session['user_id']) & mask == mask
+
+
+def permission_required(*names):
+    """要求登录且拥有所有给定权限（管理员直接通过）"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if 'user_id' not in session:
+                return jsonify({'message': '请先登录'}), 401
+            if not has_permission(*names):
+                return jsonify({'message': '没有权限执行此操作'}), 403
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def invalidate_permissions(*user_ids):
+    """标记当前事务修改了哪些用户的权限，事务提交后清除缓存"""
+    db.session.info.setdefault('permission_cache_invalidate', set()).update(user_ids)
+
+
+def _discard_permissions(user_ids):
+    permission_cache.discard(*user_ids)
+
+
+on_outer_commit('permission_cache_invalidate', _discard_permissions)
+
+
+permission_cache = PermissionCache()
@@ -0,0 +1,41 @@
+"""
+Timeline Notebook SQL 查询计数
+在调试模式下统计每个请求执行的 SQL 语句数量，用于发现 N+1 查询
+"""
+
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_listener_installed = False
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+
+def get_query_count():
+    """返回当前请求已执行的 SQL 语句数"""
+    return g.get('query_count', 0) if has_request_context() else 0
+
+
+def is_query_counter_enabled(app):
+    return app.debug or app.config.get('SQL_QUERY_COUNTER', False)
+
+
+def init_query_counter(app):
+    """调试模式下为所有引擎注册计数监听，并通过 X-Query-Count 响应头返回结果"""
+    global _listener_installed
+
+    if not is_query_counter_enabled(app):
+        return
+
+    if not _listener_installed:
+        event.listen(Engine, 'before_cursor_execute', _count_query)
+        _listener_installed = True
+
+    @app.after_request
+    def add_query_count_header(response):
+        response.headers['X-Query-Count'] = str(get_query_count())
+        return response
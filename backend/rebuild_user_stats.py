@@ -0,0 +1,30 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from models import db
+from flask import Flask
+from config import config
+from user_stats import rebuild_user_stats
+
+def main():
+    # 创建Flask应用实例
+    app = Flask(__name__)
+    config_name = os.environ.get('FLASK_ENV', 'production')
+    app_config = config.get(config_name, config['production'])
+    app.config.from_object(app_config)
+    
+    # 初始化数据库
+    db.init_app(app)
+    
+    with app.app_context():
+        db.create_all()
+        
+        # 从留言、评论、点赞明细重新统计所有用户的计数
+        count = rebuild_user_stats()
+        db.session.commit()
+        print(f"✅ 已重建 {count} 个用户的计数")
+
+
+if __name__ == '__main__':
+    main()
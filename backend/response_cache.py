@@ -0,0 +1,179 @@
+"""
+Timeline Notebook 公共接口响应缓存
+按命名空间维护代数（generation），缓存键包含当前代数；写操作提交后递增代数，旧缓存自然失效
+后端可选进程内 LRU（各 worker 独立，跨进程靠 TTL 兜底）或 Redis（多 worker 共享缓存和代数）
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, request
+
+from commit_hooks import on_outer_commit
+from models import db
+
+NAMESPACES = ('timeline', 'time_capsules', 'messages')
+
+
+class MemoryCacheBackend:
+    """进程内 LRU 缓存"""
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_generation(self, namespace):
+        with self._lock:
+            return self._generations.get(namespace, 0)
+
+    def bump_generation(self, namespace):
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+
+    def size(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class RedisCacheBackend:
+    """Redis 缓存（需要安装 redis），容量由 Redis 的 maxmemory 策略控制"""
+
+    def __init__(self, url, prefix='timeline:cache:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value), ex=max(int(ttl), 1))
+
+    def get_generation(self, namespace):
+        return int(self.client.get(f'{self.prefix}gen:{namespace}') or 0)
+
+    def bump_generation(self, namespace):
+        self.client.incr(f'{self.prefix}gen:{namespace}')
+
+    def size(self):
+        return None
+
+
+class ResponseCache:
+    def __init__(self, app=None):
+        self.app = None
+        self.backend = None
+        self.ttl = 30
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['response_cache'] = self
+        self.ttl = app.config.get('RESPONSE_CACHE_TTL', 30)
+
+        backend = app.config.get('RESPONSE_CACHE_BACKEND', 'memory')
+        if backend == 'redis':
+            self.backend = RedisCacheBackend(app.config['RESPONSE_CACHE_REDIS_URL'])
+        elif backend == 'memory':
+            self.backend = MemoryCacheBackend(app.config.get('RESPONSE_CACHE_MAX_SIZE', 256))
+        else:
+            self.backend = None
+
+    def _record(self, namespace, outcome):
+        with self._stats_lock:
+            counts = self.stats.setdefault(namespace, {'hits': 0, 'misses': 0})
+            counts[outcome] += 1
+
+    def get_stats(self):
+        """命中统计（本进程），以及缓存条目数（进程内后端）"""
+        with self._stats_lock:
+            namespaces = {
+                namespace: dict(counts, hit_rate=round(counts['hits'] / (counts['hits'] + counts['misses']), 4)
+                                if counts['hits'] + counts['misses'] else 0.0)
+                for namespace, counts in self.stats.items()
+            }
+        return {
+            'backend': self.app.config.get('RESPONSE_CACHE_BACKEND', 'memory') if self.app else None,
+            'ttl': self.ttl,
+            'size': self.backend.size() if self.backend else 0,
+            'namespaces': namespaces
+        }
+
+    def bump(self, *namespaces):
+        if self.backend is None:
+            return
+        for namespace in namespaces:
+            self.backend.bump_generation(namespace)
+
+    def cached(self, namespace):
+        """缓存 GET 接口的 200 响应，缓存键为 命名空间、代数、ETag（如有）、路径和排序后的查询参数"""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.backend is None or request.method != 'GET':
+                    return view(*args, **kwargs)
+
+                args_key = '&'.join(f'{key}={value}' for key, value in sorted(request.args.items(multi=True)))
+                # 同时使用 etag_validated 时 ETag 也进入缓存键：其他 worker 写入后本进程的代数尚未变化，
+                # 但 ETag 已随数据变化，不会把旧的响应体配上新的 ETag 返回
+                key = f'{namespace}:{self.backend.get_generation(namespace)}:{g.get("etag", "")}:{request.path}?{args_key}'
+                entry = self.backend.get(key)
+                if entry is not None:
+                    self._record(namespace, 'hits')
+                    response = current_app.response_class(entry['body'], status=200, mimetype=entry['mimetype'])
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                self._record(namespace, 'misses')
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.direct_passthrough:
+                    self.backend.set(key, {
+                        'body': response.get_data(as_text=True),
+                        'mimetype': response.mimetype
+                    }, self.ttl)
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
+
+
+def invalidate(*namespaces):
+    """标记当前事务修改了哪些公共数据，事务提交后使对应缓存失效"""
+    db.session.info.setdefault('response_cache_invalidate', set()).update(namespaces)
+
+
+def _bump_generations(namespaces):
+    response_cache.bump(*namespaces)
+
+
+on_outer_commit('response_cache_invalidate', _bump_generations)
+
+response_cache = ResponseCache()
@@ -1,9 +1,36 @@
 import os
 import uuid
-from flask import Blueprint, request, jsonify, url_for, session, send_file, current_app
+import base64
+import math
+from flask import Blueprint, request, jsonify, url_for, session, send_file, current_app, redirect, abort, Response
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from models import db, TimelineEntry, Comment, User, TimeCapsule, Message, MessageComment, MessageLike, MessageImage, KeywordFilter
+from sqlalchemy import select, delete, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+from models import db, TimelineEntry, Comment, User, TimeCapsule, Message, MessageComment, MessageLike, MessageImage, KeywordFilter, BackgroundJob, UserStats
+from query_counter import get_query_count, is_query_counter_enabled
+from keyword_matcher import get_keyword_matcher, bump_keyword_version
+from backup import (
+    BACKUP_EXTENSIONS, BackupFormatError, get_backup_dir, is_backup_filename, backup_id_from_filename, find_backup_file,
+    load_manifest, manifest_path, resolve_backup_chain, find_dependent_backups,
+    run_backup_job, run_restore_job, run_chain_restore_job
+)
+from jobs import job_runner, serialize_job
+from like_buffer import like_buffer
+from db_routing import read_replica
+from response_cache import response_cache, invalidate
+from conditional import etag_validated
+from message_events import broker as message_events, publish_event
+from capsule_guard import capsule_guard
+from password_pool import password_pool, PasswordPoolBusy
+from user_cache import user_cache, invalidate_users
+from permissions import permission_required, has_permission, invalidate_permissions
+import media_store
+import image_variants
+import user_stats
+import comment_threads
+import counters
 from datetime import datetime
 
 main = Blueprint('main', __name__)
@@ -36,22 +63,116 @@ ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'mp4', 'avi', '
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# 时光轴游标分页参数
+TIMELINE_DEFAULT_LIMIT = 20
+TIMELINE_MAX_LIMIT = 100
+
+def encode_cursor(created_at, entry_id):
+    """将 (created_at, id) 编码为不透明的游标字符串"""
+    raw = f'{created_at.isoformat()},{entry_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """解析游标，兼容不透明游标和明文 created_at,id 两种格式，非法时返回 None"""
+    candidates = [cursor]
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        candidates.insert(0, base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        pass
+
+    for raw in candidates:
+        created_at_str, sep, id_str = raw.rpartition(',')
+        if not sep:
+            continue
+        try:
+            return datetime.fromisoformat(created_at_str), int(id_str)
+        except ValueError:
+            continue
+    return None
+
+def serialize_timeline_entry(entry):
+    return {
+        'id': entry.id,
+        'title': entry.title,
+        'content': entry.content,
+        'created_at': entry.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'media_type': entry.media_type,
+        'media_url': url_for('static', filename=f'uploads/{entry.media_path}') if entry.media_path else None,
+        'media_variants': image_variants.variant_urls(entry.media_path) if entry.media_type == 'image' else None
+    }
+
+def timeline_validator():
+    """时光轴列表的 ETag 校验值：条目数、最新创建时间和最大ID"""
+    count, latest, max_id = db.session.execute(
+        select(func.count(TimelineEntry.id), func.max(TimelineEntry.created_at), func.max(TimelineEntry.id))
+    ).one()
+    return [count, latest, max_id]
+
 # 获取所有时光轴条目
 @main.route('/api/timeline', methods=['GET'])
+@read_replica
+@etag_validated(timeline_validator)
+@response_cache.cached('timeline')
 def get_timeline():
-    entries = TimelineEntry.query.order_by(TimelineEntry.created_at.desc()).all()
-    result = []
-    for entry in entries:
-        entry_data = {
-            'id': entry.id,
-            'title': entry.title,
-            'content': entry.content,
-            'created_at': entry.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'media_type': entry.media_type,
-            'media_url': url_for('static', filename=f'uploads/{entry.media_path}') if entry.media_path else None
-        }
-        result.append(entry_data)
-    return jsonify(result)
+    after = request.args.get('after')
+    limit = request.args.get('limit', type=int)
+
+    # 未传分页参数时保持原有的全量列表格式
+    if after is None and limit is None:
+        entries = TimelineEntry.query.order_by(TimelineEntry.created_at.desc(), TimelineEntry.id.desc()).all()
+        return jsonify([serialize_timeline_entry(entry) for entry in entries])
+
+    limit = min(max(limit or TIMELINE_DEFAULT_LIMIT, 1), TIMELINE_MAX_LIMIT)
+    query = TimelineEntry.query
+
+    # 键集分页：只取游标之后的行，避免 OFFSET 扫描
+    if after:
+        position = decode_cursor(after)
+        if position is None:
+            return jsonify({'message': '游标格式错误'}), 400
+        cursor_created_at, cursor_id = position
+        query = query.filter(db.or_(
+            TimelineEntry.created_at < cursor_created_at,
+            db.and_(TimelineEntry.created_at == cursor_created_at, TimelineEntry.id < cursor_id)
+        ))
+
+    # 多取一行用于判断是否还有下一页
+    entries = query.order_by(TimelineEntry.created_at.desc(), TimelineEntry.id.desc()).limit(limit + 1).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    next_cursor = None
+    if has_more:
+        last = entries[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+
+    return jsonify({
+        'entries': [serialize_timeline_entry(entry) for entry in entries],
+        'next_cursor': next_cursor,
+        'has_more': has_more,
+        'limit': limit
+    })
+
+# 按需生成图片衍生尺寸，生成后重定向到静态文件
+@main.route('/api/media/<variant>/<path:filename>', methods=['GET'])
+def get_image_variant(variant, filename):
+    if variant not in image_variants.VARIANTS or not image_variants.is_image(filename):
+        return jsonify({'message': '不支持的图片尺寸'}), 404
+    
+    # 安全检查：防止路径遍历
+    if '..' in filename.split('/') or filename.startswith('/') or filename.startswith(image_variants.VARIANT_DIR):
+        return jsonify({'message': '非法文件路径'}), 403
+    
+    try:
+        target = image_variants.generate_variant(filename, variant)
+    except Exception as e:
+        return jsonify({'message': f'图片处理失败: {str(e)}'}), 500
+    
+    if target is None:
+        return jsonify({'message': '文件不存在'}), 404
+    
+    return redirect(url_for('static', filename=f'uploads/{target}'), code=302)
 
 # 添加新的时光轴条目
 @main.route('/api/timeline', methods=['POST'])
@@ -73,21 +194,8 @@ def add_timeline_entry():
                 original_filename = file.filename
                 file_ext = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else ''
                 
-                # 使用UUID生成安全的文件名，保留原始扩展名
-                unique_filename = f'timeline_{uuid.uuid4().hex}.{file_ext}'
-                upload_folder = current_app.config.get('UPLOAD_FOLDER')
-                
-                # 确保上传目录存在
-                if not os.path.exists(upload_folder):
-                    os.makedirs(upload_folder, exist_ok=True)
-                    os.chmod(upload_folder, 0o777)
-                
-                file_path = os.path.join(upload_folder, unique_filename)
-
-                file.save(file_path)
-                
-                # 设置文件权限
-                os.chmod(file_path, 0o666)
+                # 按内容哈希存储，相同文件只保存一份
+                media_path = media_store.save_upload(file, file_ext)
 
                 # 确定文件类型
                 if file_ext in {'png', 'jpg', 'jpeg', 'gif'}:
@@ -97,13 +205,14 @@ def add_timeline_entry():
                 else:
                     new_entry.media_type = 'file'
 
-                new_entry.media_path = unique_filename
+                new_entry.media_path = media_path
 
             except Exception as e:
-
+                db.session.rollback()
                 return jsonify({'message': f'文件上传失败: {str(e)}'}), 500
 
     db.session.add(new_entry)
+    invalidate('timeline')
     db.session.commit()
 
     return jsonify({'message': '添加成功', 'id': new_entry.id}), 201
@@ -118,11 +227,8 @@ def delete_timeline_entry(entry_id):
 
     entry = TimelineEntry.query.get_or_404(entry_id)
 
-    # 如果有媒体文件，删除文件
-    if entry.media_path:
-        file_path = os.path.join(current_app.config.get('UPLOAD_FOLDER'), entry.media_path)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    # 释放媒体文件引用，没有其他引用时提交后删除文件
+    media_store.release(entry.media_path)
 
     # 删除相关评论
     comments = Comment.query.filter_by(entry_id=entry_id).all()
@@ -130,6 +236,7 @@ def delete_timeline_entry(entry_id):
         db.session.delete(comment)
 
     db.session.delete(entry)
+    invalidate('timeline')
     db.session.commit()
 
     return jsonify({'message': '删除成功'}), 200
@@ -151,10 +258,36 @@ def get_comments(entry_id):
 # 点赞时光轴条目
 @main.route('/api/timeline/<int:entry_id>/like', methods=['POST'])
 def like_timeline_entry(entry_id):
-    entry = TimelineEntry.query.get_or_404(entry_id)
-    entry.likes += 1
+    # 写缓冲模式：只记录点赞，返回数据库中的值加上尚未写入的部分
+    if like_buffer.is_enabled():
+        entry = TimelineEntry.query.get_or_404(entry_id)
+        like_buffer.add_timeline_like(entry_id)
+        return jsonify({'message': '点赞成功', 'likes': (entry.likes or 0) + like_buffer.timeline_delta(entry_id)}), 200
+    
+    likes = counters.increment(TimelineEntry.likes, TimelineEntry.id == entry_id)
+    if likes is None:
+        abort(404)
     db.session.commit()
-    return jsonify({'message': '点赞成功', 'likes': entry.likes}), 200
+    return jsonify({'message': '点赞成功', 'likes': likes}), 200
+
+# 按缓存的用户状态校验登录会话：账户被禁用或删除后会话失效，角色变更随之生效
+@main.before_request
+def check_session_user():
+    if 'user_id' not in session:
+        return
+    user = user_cache.get(session['user_id'])
+    if user is None or not user['is_active']:
+        session.clear()
+    elif session.get('role') != user['role'] or session.get('username') != user['username']:
+        session['role'] = user['role']
+        session['username'] = user['username']
+
+# 密码哈希进程池繁忙
+@main.errorhandler(PasswordPoolBusy)
+def password_pool_busy(e):
+    response = jsonify({'message': '服务器繁忙，请稍后再试'})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
 
 # 用户注册
 @main.route('/api/register', methods=['POST'])
@@ -174,7 +307,7 @@ def register():
         return jsonify({'message': '邮箱已存在'}), 400
 
     new_user = User(username=username, email=email, role=role)
-    new_user.set_password(password)
+    new_user.password_hash = password_pool.hash(password)
 
     db.session.add(new_user)
     db.session.commit()
@@ -189,7 +322,15 @@ def login():
 
 
     user = User.query.filter_by(username=username).first()
-    if user and user.check_password(password):
+    verified, new_hash = password_pool.verify(user.password_hash, password) if user else (False, None)
+    if verified and not user.is_active:
+        return jsonify({'message': '账户已被禁用'}), 403
+    if verified:
+        # 哈希参数已变更时用本次登录的明文重新生成，无需单独迁移
+        if new_hash:
+            user.password_hash = new_hash
+            db.session.commit()
+        
         session['user_id'] = user.id
         session['username'] = user.username
         session['role'] = user.role
@@ -235,18 +376,11 @@ def get_user_profile():
     if 'user_id' not in session:
         return jsonify({'message': '请先登录'}), 401
     
-    user = User.query.get_or_404(session['user_id'])
-    return jsonify({
-        'id': user.id,
-        'username': user.username,
-        'email': user.email,
-        'bio': user.bio,
-        'avatar_url': user.get_avatar_url(),
-        'role': user.role,
-        'is_active': user.is_active,
-        'created_at': user.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-        'updated_at': user.updated_at.strftime('%Y-%m-%d %H:%M:%S')
-    }), 200
+    # 会话校验时已加载到缓存，这里不再查询数据库
+    user = user_cache.get(session['user_id'])
+    if user is None:
+        abort(404)
+    return jsonify(user), 200
 
 # 更新用户信息
 @main.route('/api/user/profile', methods=['PUT'])
@@ -272,7 +406,10 @@ def update_user_profile():
     if 'bio' in data:
         user.bio = data['bio']
     
-    user.updated_at = datetime.now()
+    user.updated_at = datetime.utcnow()
+    # 留言列表中展示作者的用户名和头像
+    invalidate('messages')
+    invalidate_users(user.id)
     db.session.commit()
     
     return jsonify({'message': '用户信息更新成功'}), 200
@@ -292,11 +429,12 @@ def change_password():
     if not current_password or not new_password:
         return jsonify({'message': '当前密码和新密码不能为空'}), 400
     
-    if not user.check_password(current_password):
+    if not password_pool.verify(user.password_hash, current_password)[0]:
         return jsonify({'message': '当前密码错误'}), 400
     
-    user.set_password(new_password)
-    user.updated_at = datetime.now()
+    user.password_hash = password_pool.hash(new_password)
+    user.updated_at = datetime.utcnow()
+    invalidate_users(user.id)
     db.session.commit()
     
     return jsonify({'message': '密码修改成功'}), 200
@@ -321,31 +459,19 @@ def upload_avatar():
             return jsonify({'message': '头像只支持图片格式'}), 400
         
         try:
-            # 生成唯一文件名
-            unique_filename = f'avatar_{session["user_id"]}_{uuid.uuid4().hex}.{file_ext}'
-            upload_folder = current_app.config.get('UPLOAD_FOLDER')
-            
-            # 确保上传目录存在
-            if not os.path.exists(upload_folder):
-                os.makedirs(upload_folder, exist_ok=True)
-                os.chmod(upload_folder, 0o777)
-            
-            file_path = os.path.join(upload_folder, unique_filename)
-            file.save(file_path)
-            os.chmod(file_path, 0o666)
+            # 按内容哈希存储，相同文件只保存一份
+            media_path = media_store.save_upload(file, file_ext)
             
             # 更新用户头像URL
             user = User.query.get_or_404(session['user_id'])
             
-            # 删除旧头像文件（如果存在）
-            if user.avatar_url:
-                old_filename = user.avatar_url.split('/')[-1]
-                old_file_path = os.path.join(upload_folder, old_filename)
-                if os.path.exists(old_file_path):
-                    os.remove(old_file_path)
+            # 释放旧头像的引用
+            media_store.release(media_store.path_from_url(user.avatar_url))
             
-            user.avatar_url = url_for('static', filename=f'uploads/{unique_filename}')
-            user.updated_at = datetime.now()
+            user.avatar_url = url_for('static', filename=f'uploads/{media_path}')
+            user.updated_at = datetime.utcnow()
+            invalidate('messages')
+            invalidate_users(user.id)
             db.session.commit()
             
             return jsonify({
@@ -354,6 +480,7 @@ def upload_avatar():
             }), 200
             
         except Exception as e:
+            db.session.rollback()
             return jsonify({'message': f'头像上传失败: {str(e)}'}), 500
     
     return jsonify({'message': '不支持的文件格式'}), 400
@@ -396,19 +523,13 @@ def get_user_stats():
     
     user_id = session['user_id']
     
-    # 统计用户的留言数量
-    message_count = Message.query.filter_by(user_id=user_id).count()
-    
-    # 统计用户获得的点赞数量
-    like_count = db.session.query(MessageLike).join(Message).filter(Message.user_id == user_id).count()
-    
-    # 统计用户的评论数量
-    comment_count = MessageComment.query.filter_by(user_id=user_id).count()
+    # 读取冗余维护的计数，避免每次请求都对明细表做 COUNT
+    stats = user_stats.get_stats(user_id)
     
     return jsonify({
-        'message_count': message_count,
-        'like_count': like_count,
-        'comment_count': comment_count
+        'message_count': stats['message_count'],
+        'like_count': stats['like_count'],
+        'comment_count': stats['comment_count']
     }), 200
 
 # 获取用户的留言列表
@@ -425,13 +546,16 @@ def get_user_messages():
         page=page, per_page=per_page, error_out=False
     )
     
+    # 叠加点赞写缓冲中尚未写入的变化
+    like_deltas = like_buffer.message_deltas([message.id for message in messages.items])
+    
     result = []
     for message in messages.items:
         message_data = {
             'id': message.id,
             'content': message.content,
             'created_at': message.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'like_count': message.like_count,
+            'like_count': (message.like_count or 0) + like_deltas.get(message.id, 0),
             'comment_count': MessageComment.query.filter_by(message_id=message.id).count()
         }
         result.append(message_data)
@@ -519,26 +643,69 @@ def test_session():
 
 # ==================== 时间胶囊相关API ====================
 
+def serialize_capsule_summary(capsule, now):
+    """胶囊列表项，同一请求内的所有胶囊按同一时刻计算解锁状态"""
+    return {
+        'id': capsule.id,
+        'title': capsule.title,
+        'created_at': capsule.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'unlock_date': capsule.unlock_date.strftime('%Y-%m-%d %H:%M:%S'),
+        'question': capsule.question,
+        'can_unlock': capsule.can_unlock(now),
+        'remaining_time': capsule.get_remaining_time(now),
+        'is_unlocked': capsule.is_unlocked,
+        'media_type': capsule.media_type,
+        'has_media': capsule.media_path is not None
+    }
+
 # 获取所有时间胶囊列表
+# remaining_time 随时间变化，列表不进入共享的响应缓存
 @main.route('/api/time-capsules', methods=['GET'])
+@read_replica
 def get_time_capsules():
-    capsules = TimeCapsule.query.order_by(TimeCapsule.created_at.desc()).all()
-    result = []
-    for capsule in capsules:
-        capsule_data = {
-            'id': capsule.id,
-            'title': capsule.title,
-            'created_at': capsule.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'unlock_date': capsule.unlock_date.strftime('%Y-%m-%d %H:%M:%S'),
-            'question': capsule.question,
-            'can_unlock': capsule.can_unlock(),
-            'remaining_time': capsule.get_remaining_time(),
-            'is_unlocked': capsule.is_unlocked,
-            'media_type': capsule.media_type,
-            'has_media': capsule.media_path is not None
-        }
-        result.append(capsule_data)
-    return jsonify(result)
+    status = request.args.get('status', '').strip()
+    page = request.args.get('page', type=int)
+    per_page = request.args.get('per_page', type=int)
+    now = datetime.utcnow()
+    
+    query = TimeCapsule.query
+    
+    # 状态在数据库端按 unlock_date 索引筛选
+    if status == 'unlocked':
+        query = query.filter(TimeCapsule.is_unlocked == True)
+    elif status == 'unlockable':
+        query = query.filter(TimeCapsule.is_unlocked == False, TimeCapsule.unlock_date <= now)
+    elif status == 'locked':
+        query = query.filter(TimeCapsule.is_unlocked == False, TimeCapsule.unlock_date > now)
+    elif status:
+        return jsonify({'message': '不支持的状态筛选，可选 unlockable、locked、unlocked'}), 400
+    
+    query = query.order_by(TimeCapsule.created_at.desc(), TimeCapsule.id.desc())
+    
+    # 未传分页参数时保持原有的列表格式
+    if page is None and per_page is None:
+        return jsonify([serialize_capsule_summary(capsule, now) for capsule in query.all()])
+    
+    capsules = query.paginate(page=page or 1, per_page=per_page or 20, error_out=False)
+    # 最近一个待到期胶囊的解锁时间，走 unlock_date 索引，任何 worker 创建的胶囊都能立即反映
+    next_unlock = db.session.query(func.min(TimeCapsule.unlock_date)).filter(
+        TimeCapsule.is_unlocked == False,
+        TimeCapsule.unlock_date > now
+    ).scalar()
+    
+    return jsonify({
+        'capsules': [serialize_capsule_summary(capsule, now) for capsule in capsules.items],
+        'pagination': {
+            'page': capsules.page,
+            'pages': capsules.pages,
+            'per_page': capsules.per_page,
+            'total': capsules.total,
+            'has_next': capsules.has_next,
+            'has_prev': capsules.has_prev
+        },
+        # 距离下一个胶囊到期的秒数，客户端可据此安排刷新
+        'next_unlock_in': max(0, int((next_unlock - now).total_seconds())) if next_unlock else None
+    })
 
 # 创建新的时间胶囊
 @main.route('/api/time-capsules', methods=['POST'])
@@ -601,12 +768,8 @@ def create_time_capsule():
                     original_filename = file.filename
                     file_ext = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else ''
                     
-                    # 使用UUID生成安全的文件名，保留原始扩展名
-                    unique_filename = f'capsule_{uuid.uuid4().hex}.{file_ext}'
-                    file_path = os.path.join(current_app.config.get('UPLOAD_FOLDER'), unique_filename)
-                    
-
-                    file.save(file_path)
+                    # 按内容哈希存储，相同文件只保存一份
+                    media_path = media_store.save_upload(file, file_ext)
                     
                     # 确定文件类型
                     if file_ext in {'png', 'jpg', 'jpeg', 'gif'}:
@@ -616,7 +779,7 @@ def create_time_capsule():
                     else:
                         new_capsule.media_type = 'file'
                     
-                    new_capsule.media_path = unique_filename
+                    new_capsule.media_path = media_path
 
                 else:
                     return jsonify({'message': '不支持的文件类型'}), 400
@@ -624,6 +787,7 @@ def create_time_capsule():
                 pass
         
         db.session.add(new_capsule)
+        invalidate('time_capsules')
         db.session.commit()
         
 
@@ -641,6 +805,13 @@ def unlock_time_capsule(capsule_id):
     if not answer:
         return jsonify({'message': '答案不能为空'}), 400
     
+    # 限流在查询数据库和计算哈希之前进行，被拒绝的请求不产生任何开销
+    allowed, retry_after = capsule_guard.check(capsule_id)
+    if not allowed:
+        response = jsonify({'message': '尝试过于频繁，请稍后再试'})
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response, 429
+    
     capsule = TimeCapsule.query.get_or_404(capsule_id)
     
     # 检查时间是否到达
@@ -650,12 +821,11 @@ def unlock_time_capsule(capsule_id):
             'remaining_time': capsule.get_remaining_time()
         }), 403
     
-    # 增加尝试次数
-    capsule.unlock_attempts += 1
-    
-    # 验证答案
+    # 验证答案（答对时旧格式的哈希随本次提交一起升级）
     if capsule.check_answer(answer):
+        counters.increment(TimeCapsule.unlock_attempts, TimeCapsule.id == capsule.id)
         capsule.is_unlocked = True
+        invalidate('time_capsules')
         db.session.commit()
         
         # 返回胶囊内容
@@ -675,10 +845,11 @@ def unlock_time_capsule(capsule_id):
             'capsule': capsule_data
         }), 200
     else:
-        db.session.commit()
+        # 答错只记入进程内缓冲，由后台线程合并写库
+        capsule_guard.attempts.add(capsule.id)
         return jsonify({
             'message': '答案错误',
-            'attempts': capsule.unlock_attempts
+            'attempts': (capsule.unlock_attempts or 0) + capsule_guard.attempts.pending(capsule.id)
         }), 401
 
 # 获取已解锁的时间胶囊详情
@@ -712,13 +883,11 @@ def delete_time_capsule(capsule_id):
     
     capsule = TimeCapsule.query.get_or_404(capsule_id)
     
-    # 如果有媒体文件，删除文件
-    if capsule.media_path:
-        file_path = os.path.join(current_app.config.get('UPLOAD_FOLDER'), capsule.media_path)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    # 释放媒体文件引用，没有其他引用时提交后删除文件
+    media_store.release(capsule.media_path)
     
     db.session.delete(capsule)
+    invalidate('time_capsules')
     db.session.commit()
     
     return jsonify({'message': '时间胶囊删除成功'}), 200
@@ -762,92 +931,32 @@ def create_backup():
         return jsonify({'message': '没有权限执行此操作'}), 403
     
     try:
-        import json
-        from datetime import datetime
-        
-        # 创建备份数据
-        backup_data = {
-            'created_at': datetime.now().isoformat(),
-            'version': '1.0',
-            'timeline_entries': [],
-            'time_capsules': [],
-            'users': [],
-            'comments': []
-        }
-        
-        # 备份时光轴条目
-        entries = TimelineEntry.query.all()
-        for entry in entries:
-            entry_data = {
-                'id': entry.id,
-                'title': entry.title,
-                'content': entry.content,
-                'date': entry.date.isoformat(),
-                'media_type': entry.media_type,
-                'media_path': entry.media_path,
-                'created_at': entry.created_at.isoformat()
-            }
-            backup_data['timeline_entries'].append(entry_data)
-        
-        # 备份时间胶囊
-        capsules = TimeCapsule.query.all()
-        for capsule in capsules:
-            capsule_data = {
-                'id': capsule.id,
-                'title': capsule.title,
-                'content': capsule.content,
-                'unlock_date': capsule.unlock_date.isoformat(),
-                'question': capsule.question,
-                'answer_hash': capsule.answer_hash,
-                'media_type': capsule.media_type,
-                'media_path': capsule.media_path,
-                'is_unlocked': capsule.is_unlocked,
-                'unlock_attempts': capsule.unlock_attempts,
-                'created_at': capsule.created_at.isoformat()
-            }
-            backup_data['time_capsules'].append(capsule_data)
-        
-        # 备份用户数据
-        users = User.query.all()
-        for user in users:
-            user_data = {
-                'id': user.id,
-                'username': user.username,
-                'password_hash': user.password_hash,
-                'role': user.role,
-                'created_at': user.created_at.isoformat()
-            }
-            backup_data['users'].append(user_data)
-        
-        # 备份评论数据
-        comments = Comment.query.all()
-        for comment in comments:
-            comment_data = {
-                'id': comment.id,
-                'content': comment.content,
-                'timeline_entry_id': comment.timeline_entry_id,
-                'created_at': comment.created_at.isoformat()
-            }
-            backup_data['comments'].append(comment_data)
+        # 备份模式：full 全量，incremental 只导出上次备份之后的变更
+        data = request.get_json(silent=True) or {}
+        mode = data.get('mode') or request.args.get('mode', 'full')
+        if mode not in ('full', 'incremental'):
+            return jsonify({'message': '不支持的备份模式'}), 400
         
         # 生成备份文件名
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'backup_{timestamp}.json'
-        
-        # 确保备份目录存在
-        backup_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backups')
-        os.makedirs(backup_dir, exist_ok=True)
-        
-        # 保存备份文件
-        backup_path = os.path.join(backup_dir, filename)
-        with open(backup_path, 'w', encoding='utf-8') as f:
-            json.dump(backup_data, f, ensure_ascii=False, indent=2)
+        filename = f'backup_{timestamp}.jsonl.gz'
+        
+        # 备份在后台任务中执行，立即返回任务ID
+        job_id = job_runner.submit(
+            'backup', run_backup_job, filename,
+            batch_size=current_app.config.get('BACKUP_BATCH_SIZE', 1000),
+            incremental=mode == 'incremental',
+            safety_margin=current_app.config.get('BACKUP_INCREMENTAL_MARGIN', 300),
+            created_by=session['user_id']
+        )
         
         return jsonify({
-            'message': '备份创建成功',
+            'message': '备份任务已创建',
+            'job_id': job_id,
             'filename': filename,
-            'download_url': url_for('main.download_backup', filename=filename)
-        }), 200
+            'mode': mode,
+            'status_url': url_for('main.get_job_status', job_id=job_id)
+        }), 202
         
     except Exception as e:
 
@@ -863,22 +972,27 @@ def get_backup_history():
         return jsonify({'message': '没有权限执行此操作'}), 403
     
     try:
-        backup_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backups')
+        backup_dir = get_backup_dir()
         
         if not os.path.exists(backup_dir):
             return jsonify([]), 200
         
         backups = []
         for filename in os.listdir(backup_dir):
-            if filename.endswith('.json') and filename.startswith('backup_'):
+            if is_backup_filename(filename):
                 file_path = os.path.join(backup_dir, filename)
                 file_stat = os.stat(file_path)
                 
+                backup_id = backup_id_from_filename(filename)
+                manifest = load_manifest(backup_id) or {}
                 backup_info = {
-                    'id': filename.replace('.json', ''),
+                    'id': backup_id,
                     'filename': filename,
                     'created_at': datetime.fromtimestamp(file_stat.st_ctime).isoformat(),
-                    'size': file_stat.st_size
+                    'size': file_stat.st_size,
+                    'mode': manifest.get('mode', 'full'),
+                    'base': manifest.get('base'),
+                    'parent': manifest.get('parent')
                 }
                 backups.append(backup_info)
         
@@ -899,10 +1013,17 @@ def download_backup(filename):
         return jsonify({'message': '没有权限执行此操作'}), 403
     
     try:
-        backup_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backups')
+        backup_dir = get_backup_dir()
+        
+        # 同时支持按文件名和备份ID下载
+        if not is_backup_filename(filename):
+            try:
+                filename = find_backup_file(filename) or filename
+            except BackupFormatError as e:
+                return jsonify({'message': str(e)}), 400
         file_path = os.path.join(backup_dir, filename)
         
-        if not os.path.exists(file_path) or not filename.endswith('.json'):
+        if not os.path.exists(file_path) or not is_backup_filename(filename):
             return jsonify({'message': '备份文件不存在'}), 404
         
         return send_file(file_path, as_attachment=True, download_name=filename)
@@ -919,14 +1040,22 @@ def delete_backup(backup_id):
         return jsonify({'message': '没有权限执行此操作'}), 403
     
     try:
-        backup_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backups')
-        filename = f'{backup_id}.json'
-        file_path = os.path.join(backup_dir, filename)
+        try:
+            filename = find_backup_file(backup_id)
+        except BackupFormatError as e:
+            return jsonify({'message': str(e)}), 400
         
-        if not os.path.exists(file_path):
+        if not filename:
             return jsonify({'message': '备份文件不存在'}), 404
         
-        os.remove(file_path)
+        # 被增量备份依赖的备份不能单独删除
+        dependents = find_dependent_backups(backup_id)
+        if dependents:
+            return jsonify({'message': f'该备份被增量备份依赖，请先删除: {", ".join(dependents)}'}), 400
+        
+        os.remove(os.path.join(get_backup_dir(), filename))
+        if os.path.exists(manifest_path(backup_id)):
+            os.remove(manifest_path(backup_id))
         return jsonify({'message': '备份删除成功'}), 200
         
     except Exception as e:
@@ -941,6 +1070,28 @@ def restore_from_backup():
         return jsonify({'message': '没有权限执行此操作'}), 403
     
     try:
+        # 还原服务器上的备份（增量备份会连同基础全量备份和之前的增量一起回放）
+        backup_id = request.form.get('backup_id') or (request.get_json(silent=True) or {}).get('backup_id')
+        if backup_id:
+            try:
+                chain = resolve_backup_chain(backup_id)
+            except BackupFormatError as e:
+                return jsonify({'message': str(e)}), 400
+            
+            job_id = job_runner.submit(
+                'restore', run_chain_restore_job, backup_id,
+                batch_size=current_app.config.get('BACKUP_BATCH_SIZE', 1000),
+                created_by=session['user_id'],
+                persist_progress=db.engine.dialect.name != 'sqlite'
+            )
+            
+            return jsonify({
+                'message': '还原任务已创建',
+                'job_id': job_id,
+                'chain': [manifest['id'] for manifest in chain],
+                'status_url': url_for('main.get_job_status', job_id=job_id)
+            }), 202
+        
         if 'backup_file' not in request.files:
             return jsonify({'message': '没有上传备份文件'}), 400
         
@@ -948,83 +1099,28 @@ def restore_from_backup():
         if file.filename == '':
             return jsonify({'message': '没有选择文件'}), 400
         
-        if not file.filename.endswith('.json'):
-            return jsonify({'message': '请上传JSON格式的备份文件'}), 400
-        
-        # 读取备份数据
-        import json
-        backup_data = json.load(file)
-        
-        # 验证备份文件格式
-        required_keys = ['timeline_entries', 'time_capsules', 'users', 'comments']
-        if not all(key in backup_data for key in required_keys):
-            return jsonify({'message': '备份文件格式不正确'}), 400
-        
-        # 开始还原过程
-        # 清空现有数据
-        Comment.query.delete()
-        TimeCapsule.query.delete()
-        TimelineEntry.query.delete()
-        # 保留管理员用户，删除其他用户
-        User.query.filter(User.role != 'admin').delete()
-        
-        # 还原时光轴条目
-        for entry_data in backup_data['timeline_entries']:
-            entry = TimelineEntry(
-                title=entry_data['title'],
-                content=entry_data['content'],
-                date=datetime.fromisoformat(entry_data['date']),
-                media_type=entry_data.get('media_type'),
-                media_path=entry_data.get('media_path')
-            )
-            if 'created_at' in entry_data:
-                entry.created_at = datetime.fromisoformat(entry_data['created_at'])
-            db.session.add(entry)
-        
-        # 还原时间胶囊
-        for capsule_data in backup_data['time_capsules']:
-            capsule = TimeCapsule(
-                title=capsule_data['title'],
-                content=capsule_data['content'],
-                unlock_date=datetime.fromisoformat(capsule_data['unlock_date']),
-                question=capsule_data['question'],
-                media_type=capsule_data.get('media_type'),
-                media_path=capsule_data.get('media_path'),
-                is_unlocked=capsule_data.get('is_unlocked', False),
-                unlock_attempts=capsule_data.get('unlock_attempts', 0)
-            )
-            capsule.answer_hash = capsule_data['answer_hash']
-            if 'created_at' in capsule_data:
-                capsule.created_at = datetime.fromisoformat(capsule_data['created_at'])
-            db.session.add(capsule)
-        
-        # 还原用户数据（跳过管理员用户）
-        for user_data in backup_data['users']:
-            if user_data['role'] != 'admin':  # 不覆盖管理员用户
-                existing_user = User.query.filter_by(username=user_data['username']).first()
-                if not existing_user:
-                    user = User(
-                        username=user_data['username'],
-                        role=user_data['role']
-                    )
-                    user.password_hash = user_data['password_hash']
-                    if 'created_at' in user_data:
-                        user.created_at = datetime.fromisoformat(user_data['created_at'])
-                    db.session.add(user)
-        
-        # 还原评论数据
-        for comment_data in backup_data['comments']:
-            comment = Comment(
-                content=comment_data['content'],
-                timeline_entry_id=comment_data['timeline_entry_id']
-            )
-            if 'created_at' in comment_data:
-                comment.created_at = datetime.fromisoformat(comment_data['created_at'])
-            db.session.add(comment)
-        
-        db.session.commit()
+        if not file.filename.endswith(BACKUP_EXTENSIONS):
+            return jsonify({'message': '请上传 .jsonl.gz 或 .json 格式的备份文件'}), 400
+        
+        # 上传文件先落盘，请求结束后由后台任务解析还原
+        upload_dir = os.path.join(get_backup_dir(), 'uploads')
+        os.makedirs(upload_dir, exist_ok=True)
+        upload_path = os.path.join(upload_dir, f'{uuid.uuid4().hex}_{secure_filename(file.filename)}')
+        file.save(upload_path)
+        
+        # SQLite 还原期间持有写锁，进度只保存在进程内
+        job_id = job_runner.submit(
+            'restore', run_restore_job, upload_path, file.filename,
+            batch_size=current_app.config.get('BACKUP_BATCH_SIZE', 1000),
+            created_by=session['user_id'],
+            persist_progress=db.engine.dialect.name != 'sqlite'
+        )
         
-        return jsonify({'message': '数据还原成功'}), 200
+        return jsonify({
+            'message': '还原任务已创建',
+            'job_id': job_id,
+            'status_url': url_for('main.get_job_status', job_id=job_id)
+        }), 202
         
     except Exception as e:
         db.session.rollback()
@@ -1034,6 +1130,38 @@ def restore_from_backup():
         return jsonify({'message': f'数据还原失败: {str(e)}'}), 500
 
 
+# 查询后台任务状态（管理员功能）
+@main.route('/api/admin/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    # 检查是否为管理员
+    if 'user_id' not in session or session['role'] != 'admin':
+        return jsonify({'message': '没有权限执行此操作'}), 403
+    
+    # 先回收执行进程已退出的遗留任务，轮询的客户端会拿到 failed 状态而不是一直等待
+    job_runner.reconcile()
+    
+    job = db.session.get(BackgroundJob, job_id)
+    if not job:
+        return jsonify({'message': '任务不存在'}), 404
+    
+    job_data = serialize_job(job)
+    
+    # 备份完成后附带下载地址
+    if job.job_type == 'backup' and job.status == 'succeeded' and job_data['result']:
+        job_data['result']['download_url'] = url_for('main.download_backup', filename=job_data['result']['filename'])
+    
+    return jsonify(job_data), 200
+
+# 查看响应缓存命中统计（管理员功能）
+@main.route('/api/admin/cache/stats', methods=['GET'])
+def get_cache_stats():
+    # 检查是否为管理员
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'message': '没有权限执行此操作'}), 403
+    
+    return jsonify(response_cache.get_stats()), 200
+
+
 # ==================== 留言墙相关API ====================
 
 # 内容审核和关键词过滤函数
@@ -1042,55 +1170,83 @@ def filter_content(content):
     if not content:
         return True, content
     
-    # 获取所有活跃的关键词过滤规则
-    filters = KeywordFilter.query.filter_by(is_active=True).all()
-    
-    for filter_rule in filters:
-        if filter_rule.keyword.lower() in content.lower():
-            return False, f"内容包含敏感词汇: {filter_rule.keyword}"
+    # 使用缓存的多模式匹配自动机，一次扫描完成全部关键词检查
+    matcher = get_keyword_matcher(current_app.config.get('KEYWORD_FILTER_CACHE_TTL', 60))
+    keyword = matcher.search(content)
+    if keyword is not None:
+        return False, f"内容包含敏感词汇: {keyword}"
     
     return True, content
 
+def serialize_message(message, like_delta=0):
+    """留言墙列表中的留言格式，like_delta 为点赞写缓冲中尚未写入的变化"""
+    # 获取留言的图片
+    images = [{
+        'id': img.id,
+        'url': url_for('static', filename=f'uploads/{img.image_url}'),
+        'name': img.image_name,
+        'variants': image_variants.variant_urls(img.image_url)
+    } for img in message.images]
+    
+    return {
+        'id': message.id,
+        'content': message.content,
+        'is_pinned': message.is_pinned,
+        'like_count': (message.like_count or 0) + like_delta,
+        'comment_count': message.comment_count,
+        'created_at': message.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'user': {
+            'id': message.user.id,
+            'username': message.user.username,
+            'avatar_url': message.user.get_avatar_url()
+        },
+        'images': images
+    }
+
+def messages_validator():
+    """
+    留言列表的 ETag 校验值：已发布留言数、最新创建/更新时间（点赞、评论数和置顶变化都会更新 updated_at）、
+    以及作者资料的最新更新时间。点赞写缓冲中尚未写入的部分不计入（各进程不同），
+    合并写入数据库时 updated_at 随之更新，ETag 最多延迟一个写入间隔
+    """
+    count, latest_created, latest_updated, latest_user_updated = db.session.execute(
+        select(
+            func.count(Message.id),
+            func.max(Message.created_at),
+            func.max(Message.updated_at),
+            select(func.max(User.updated_at)).scalar_subquery()
+        ).where(Message.status == 'published')
+    ).one()
+    return [count, latest_created, latest_updated, latest_user_updated]
+
 # 获取所有留言
 @main.route('/api/messages', methods=['GET'])
+@read_replica
+@etag_validated(messages_validator)
+@response_cache.cached('messages')
 def get_messages():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
     
     # 分页查询，置顶的留言优先显示
-    messages = Message.query.filter_by(status='published').order_by(
+    # 作者随主查询JOIN加载、图片按页批量加载，列表本身每页固定3条SQL（计数、留言+作者、图片），
+    # 加上 ETag 校验值的1条聚合查询共4条；缓存命中或返回 304 时只有校验值查询
+    messages = Message.query.options(
+        joinedload(Message.user),
+        selectinload(Message.images)
+    ).filter_by(status='published').order_by(
         Message.is_pinned.desc(),
         Message.created_at.desc()
     ).paginate(
         page=page, per_page=per_page, error_out=False
     )
     
-    result = []
-    for message in messages.items:
-        # 获取留言的图片
-        images = [{
-            'id': img.id,
-            'url': url_for('static', filename=f'uploads/{img.image_url}'),
-            'name': img.image_name
-        } for img in message.images]
-        
-        message_data = {
-            'id': message.id,
-            'content': message.content,
-            'is_pinned': message.is_pinned,
-            'like_count': message.like_count,
-            'comment_count': message.comment_count,
-            'created_at': message.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'user': {
-                'id': message.user.id,
-                'username': message.user.username,
-                'avatar_url': message.user.get_avatar_url()
-            },
-            'images': images
-        }
-        result.append(message_data)
+    # 叠加点赞写缓冲中尚未写入的变化
+    like_deltas = like_buffer.message_deltas([message.id for message in messages.items])
     
-    return jsonify({
+    result = [serialize_message(message, like_deltas.get(message.id, 0)) for message in messages.items]
+    
+    response_data = {
         'messages': result,
         'pagination': {
             'page': messages.page,
@@ -1100,7 +1256,41 @@ def get_messages():
             'has_next': messages.has_next,
             'has_prev': messages.has_prev
         }
-    })
+    }
+    
+    if is_query_counter_enabled(current_app):
+        response_data['debug'] = {'query_count': get_query_count()}
+    
+    return jsonify(response_data)
+
+# 留言墙事件流（SSE）：新留言、点赞和评论
+@main.route('/api/messages/stream', methods=['GET'])
+def stream_messages():
+    # EventSource 首次连接无法设置请求头，也支持通过查询参数传入
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    
+    # 每个事件流在连接期间占用一个线程，限制单个 worker 的事件流数量，其余线程留给普通接口
+    if not message_events.try_acquire_stream():
+        response = jsonify({'message': '实时连接数已满，请稍后再试'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    
+    try:
+        stream = message_events.stream(
+            last_event_id,
+            heartbeat=current_app.config.get('MESSAGE_STREAM_HEARTBEAT', 15),
+            max_duration=current_app.config.get('MESSAGE_STREAM_MAX_DURATION', 300)
+        )
+    except Exception:
+        message_events.release_stream()
+        raise
+    response = Response(stream, mimetype='text/event-stream')
+    # 连接关闭（包括客户端断开）时归还名额
+    response.call_on_close(message_events.release_stream)
+    response.headers['Cache-Control'] = 'no-cache'
+    # 关闭 nginx 代理缓冲，事件立即送达
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 # 发布新留言
 @main.route('/api/messages', methods=['POST'])
@@ -1127,6 +1317,8 @@ def create_message():
     
     db.session.add(new_message)
     db.session.flush()  # 获取message的ID
+    user_stats.bump(new_message.user_id, message_count=1)
+    invalidate('messages')
     
     # 处理图片上传
     uploaded_images = []
@@ -1135,35 +1327,33 @@ def create_message():
         for file in files:
             if file and file.filename != '' and allowed_file(file.filename):
                 try:
-                    # 生成安全的文件名
+                    # 获取原始文件名和扩展名
                     original_filename = file.filename
                     file_ext = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else ''
-                    unique_filename = f'message_{uuid.uuid4().hex}.{file_ext}'
-                    
-                    upload_folder = current_app.config.get('UPLOAD_FOLDER')
-                    if not os.path.exists(upload_folder):
-                        os.makedirs(upload_folder, exist_ok=True)
                     
-                    file_path = os.path.join(upload_folder, unique_filename)
-                    file.save(file_path)
+                    # 按内容哈希存储，相同文件只保存一份
+                    media_path = media_store.save_upload(file, file_ext)
                     
                     # 保存图片信息到数据库
                     message_image = MessageImage(
                         message_id=new_message.id,
-                        image_url=unique_filename,
+                        image_url=media_path,
                         image_name=original_filename,
-                        file_size=os.path.getsize(file_path)
+                        file_size=media_store.get_size(media_path)
                     )
                     db.session.add(message_image)
                     uploaded_images.append({
                         'name': original_filename,
-                        'url': url_for('static', filename=f'uploads/{unique_filename}')
+                        'url': url_for('static', filename=f'uploads/{media_path}')
                     })
                     
                 except Exception as e:
     
                     continue
     
+    # 提交后推送给留言墙的订阅者
+    db.session.flush()
+    publish_event('message_created', serialize_message(new_message))
     db.session.commit()
     
     return jsonify({
@@ -1181,30 +1371,36 @@ def delete_message(message_id):
     
     message = Message.query.get_or_404(message_id)
     
-    # 检查权限：只有留言作者或管理员可以删除
-    if message.user_id != session['user_id'] and session.get('role') != 'admin':
+    # 检查权限：只有留言作者或拥有内容管理权限的用户可以删除
+    if message.user_id != session['user_id'] and not has_permission('admin_content'):
         return jsonify({'message': '没有权限删除此留言'}), 403
     
-    # 删除相关的图片文件
+    # 释放图片引用，没有其他引用时提交后删除文件
     for image in message.images:
-        file_path = os.path.join(current_app.config.get('UPLOAD_FOLDER'), image.image_url)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        media_store.release(image.image_url)
+    
+    # 同步扣减作者的留言数、获赞数，以及各评论者的评论数（评论随留言级联删除）
+    user_stats.bump(message.user_id, message_count=-1, like_count=-len(message.likes))
+    comment_counts = {}
+    for comment in message.comments:
+        comment_counts[comment.user_id] = comment_counts.get(comment.user_id, 0) + 1
+    for comment_user_id, count in comment_counts.items():
+        user_stats.bump(comment_user_id, comment_count=-count)
     
     db.session.delete(message)
+    invalidate('messages')
+    publish_event('message_deleted', {'id': message_id})
     db.session.commit()
     
     return jsonify({'message': '留言删除成功'}), 200
 
 # 置顶/取消置顶留言（管理员功能）
 @main.route('/api/messages/<int:message_id>/pin', methods=['POST'])
+@permission_required('admin_content')
 def toggle_pin_message(message_id):
-    # 检查是否为管理员
-    if 'user_id' not in session or session.get('role') != 'admin':
-        return jsonify({'message': '没有权限执行此操作'}), 403
-    
     message = Message.query.get_or_404(message_id)
     message.is_pinned = not message.is_pinned
+    invalidate('messages')
     db.session.commit()
     
     action = '置顶' if message.is_pinned else '取消置顶'
@@ -1220,35 +1416,51 @@ def toggle_like_message(message_id):
     message = Message.query.get_or_404(message_id)
     user_id = session['user_id']
     
-    # 检查用户是否已经点赞
-    existing_like = MessageLike.query.filter_by(
-        user_id=user_id,
-        message_id=message_id
-    ).first()
+    # 写缓冲模式：只记录点赞意图，由后台线程合并写入
+    if like_buffer.is_enabled():
+        is_liked = like_buffer.toggle_message_like(user_id, message_id)
+        response_cache.bump('messages')
+        action = '点赞' if is_liked else '取消点赞'
+        like_count = max(0, (message.like_count or 0) + like_buffer.message_delta(message_id))
+        return jsonify({
+            'message': f'{action}成功',
+            'is_liked': is_liked,
+            'like_count': like_count
+        }), 200
     
-    if existing_like:
+    invalidate('messages')
+    
+    # 已点赞则取消：以实际删除的行数为准，并发的重复请求只会扣减一次
+    deleted = db.session.execute(
+        delete(MessageLike).where(MessageLike.user_id == user_id, MessageLike.message_id == message_id)
+    ).rowcount
+    
+    if deleted:
         # 取消点赞
-        db.session.delete(existing_like)
-        message.like_count = max(0, message.like_count - 1)
+        like_count = counters.increment(Message.like_count, Message.id == message_id, -1, minimum=0)
+        user_stats.bump(message.user_id, like_count=-1)
         is_liked = False
         action = '取消点赞'
     else:
-        # 添加点赞
-        new_like = MessageLike(
-            user_id=user_id,
-            message_id=message_id
-        )
-        db.session.add(new_like)
-        message.like_count += 1
+        # 添加点赞，唯一约束冲突说明同一用户的另一个请求已经点过赞
+        try:
+            with db.session.begin_nested():
+                db.session.add(MessageLike(user_id=user_id, message_id=message_id))
+        except IntegrityError:
+            like_count = db.session.execute(select(Message.like_count).where(Message.id == message_id)).scalar()
+        else:
+            like_count = counters.increment(Message.like_count, Message.id == message_id)
+            user_stats.bump(message.user_id, like_count=1)
         is_liked = True
         action = '点赞'
     
+    publish_event('message_liked', {'id': message_id, 'like_count': like_count})
     db.session.commit()
     
     return jsonify({
         'message': f'{action}成功',
         'is_liked': is_liked,
-        'like_count': message.like_count
+        'like_count': like_count
     }), 200
 
 # 获取留言详情
@@ -1274,12 +1486,16 @@ def get_message_detail(message_id):
             message_id=message_id
         ).first()
         is_liked = like is not None
+        # 叠加点赞写缓冲中尚未写入的状态
+        pending_liked = like_buffer.user_liked(session['user_id'], message_id)
+        if pending_liked is not None:
+            is_liked = pending_liked
     
     message_data = {
         'id': message.id,
         'content': message.content,
         'is_pinned': message.is_pinned,
-        'like_count': message.like_count,
+        'like_count': (message.like_count or 0) + like_buffer.message_delta(message_id),
         'comment_count': message.comment_count,
         'created_at': message.created_at.strftime('%Y-%m-%d %H:%M:%S'),
         'user': {
@@ -1295,8 +1511,33 @@ def get_message_detail(message_id):
 
 # ==================== 留言评论相关API ====================
 
+def serialize_message_comment(comment):
+    """留言评论转为接口返回格式"""
+    return {
+        'id': comment.id,
+        'content': comment.content,
+        'created_at': comment.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'parent_id': comment.parent_id,
+        'user': {
+            'id': comment.user.id,
+            'username': comment.user.username,
+            'avatar_url': comment.user.get_avatar_url()
+        }
+    }
+
+def serialize_parent_comment(parent_comment):
+    """被回复评论的摘要信息"""
+    return {
+        'id': parent_comment.id,
+        'content': parent_comment.content[:50] + '...' if len(parent_comment.content) > 50 else parent_comment.content,
+        'user': {
+            'username': parent_comment.user.username
+        }
+    }
+
 # 获取留言的评论
 @main.route('/api/messages/<int:message_id>/comments', methods=['GET'])
+@read_replica
 def get_message_comments(message_id):
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
@@ -1306,39 +1547,22 @@ def get_message_comments(message_id):
     if message.status != 'published':
         return jsonify({'message': '留言不存在或未发布'}), 404
     
-    # 分页查询评论
-    comments = MessageComment.query.filter_by(
-        message_id=message_id
-    ).order_by(
-        MessageComment.created_at.asc()
-    ).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    # format=tree 时按顶层评论分页，返回嵌套的回复树
+    if request.args.get('format') == 'tree':
+        roots, children = comment_threads.load_thread_page(message_id, page, per_page)
+        return jsonify(comment_threads.build_tree(roots, children, serialize_message_comment))
+    
+    # 分页查询评论，父评论批量预取
+    comments, parents = comment_threads.load_flat_page(message_id, page, per_page)
     
     result = []
-    for comment in comments.items:
-        comment_data = {
-            'id': comment.id,
-            'content': comment.content,
-            'created_at': comment.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'user': {
-                'id': comment.user.id,
-                'username': comment.user.username,
-                'avatar_url': comment.user.get_avatar_url()
-            }
-        }
+    for comment in comments:
+        comment_data = serialize_message_comment(comment)
         
         # 如果是回复评论，添加父评论信息
-        if comment.parent_id:
-            parent_comment = MessageComment.query.get(comment.parent_id)
-            if parent_comment:
-                comment_data['parent'] = {
-                    'id': parent_comment.id,
-                    'content': parent_comment.content[:50] + '...' if len(parent_comment.content) > 50 else parent_comment.content,
-                    'user': {
-                        'username': parent_comment.user.username
-                    }
-                }
+        parent_comment = parents.get(comment.parent_id) if comment.parent_id else None
+        if parent_comment:
+            comment_data['parent'] = serialize_parent_comment(parent_comment)
         
         result.append(comment_data)
     
@@ -1387,10 +1611,11 @@ def create_message_comment(message_id):
     
     db.session.add(new_comment)
     
-    # 更新留言的评论数量
-    message.comment_count += 1
-    
-    db.session.commit()
+    # 更新留言的评论数量和评论者的计数
+    comment_count = counters.increment(Message.comment_count, Message.id == message_id)
+    invalidate('messages')
+    user_stats.bump(new_comment.user_id, comment_count=1)
+    db.session.flush()  # 获取评论ID和创建时间
     
     # 返回新创建的评论信息
     comment_data = {
@@ -1408,13 +1633,15 @@ def create_message_comment(message_id):
     if new_comment.parent_id:
         parent_comment = MessageComment.query.get(new_comment.parent_id)
         if parent_comment:
-            comment_data['parent'] = {
-                'id': parent_comment.id,
-                'content': parent_comment.content[:50] + '...' if len(parent_comment.content) > 50 else parent_comment.content,
-                'user': {
-                    'username': parent_comment.user.username
-                }
-            }
+            comment_data['parent'] = serialize_parent_comment(parent_comment)
+    
+    # 事件随评论一起提交，推送给留言墙的订阅者
+    publish_event('message_commented', {
+        'id': message_id,
+        'comment_count': comment_count,
+        'comment': comment_data
+    })
+    db.session.commit()
     
     return jsonify({
         'message': '评论发布成功',
@@ -1433,19 +1660,17 @@ def delete_message_comment(message_id, comment_id):
         message_id=message_id
     ).first_or_404()
     
-    # 检查权限：只有评论作者或管理员可以删除
-    if comment.user_id != session['user_id'] and session.get('role') != 'admin':
+    # 检查权限：只有评论作者或拥有内容管理权限的用户可以删除
+    if comment.user_id != session['user_id'] and not has_permission('admin_content'):
         return jsonify({'message': '没有权限删除此评论'}), 403
     
-    # 获取留言对象
-    message = Message.query.get(message_id)
-    
     # 删除评论
     db.session.delete(comment)
+    user_stats.bump(comment.user_id, comment_count=-1)
     
     # 更新留言的评论数量
-    if message:
-        message.comment_count = max(0, message.comment_count - 1)
+    counters.increment(Message.comment_count, Message.id == message_id, -1, minimum=0)
+    invalidate('messages')
     
     db.session.commit()
     
@@ -1455,22 +1680,26 @@ def delete_message_comment(message_id, comment_id):
 
 # 获取所有留言（管理员功能）
 @main.route('/api/admin/messages', methods=['GET'])
+@permission_required('admin_content')
+@read_replica
 def get_admin_messages():
-    # 检查是否为管理员
-    if 'user_id' not in session or session.get('role') != 'admin':
-        return jsonify({'message': '没有权限执行此操作'}), 403
-    
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
     
     # 获取所有留言（包括草稿），置顶的留言优先显示
-    messages = Message.query.order_by(
+    messages = Message.query.options(
+        joinedload(Message.user),
+        selectinload(Message.images)
+    ).order_by(
         Message.is_pinned.desc(),
         Message.created_at.desc()
     ).paginate(
         page=page, per_page=per_page, error_out=False
     )
     
+    # 叠加点赞写缓冲中尚未写入的变化
+    like_deltas = like_buffer.message_deltas([message.id for message in messages.items])
+    
     result = []
     for message in messages.items:
         # 获取留言的图片
@@ -1485,7 +1714,7 @@ def get_admin_messages():
             'content': message.content,
             'status': message.status,
             'is_pinned': message.is_pinned,
-            'like_count': message.like_count,
+            'like_count': (message.like_count or 0) + like_deltas.get(message.id, 0),
             'comment_count': message.comment_count,
             'created_at': message.created_at.strftime('%Y-%m-%d %H:%M:%S'),
             'user': {
@@ -1501,11 +1730,8 @@ def get_admin_messages():
 
 # 获取关键词过滤列表（管理员功能）
 @main.route('/api/admin/keyword-filters', methods=['GET'])
+@permission_required('admin_content')
 def get_keyword_filters():
-    # 检查是否为管理员
-    if 'user_id' not in session or session.get('role') != 'admin':
-        return jsonify({'message': '没有权限执行此操作'}), 403
-    
     filters = KeywordFilter.query.order_by(KeywordFilter.created_at.desc()).all()
     
     result = []
@@ -1521,11 +1747,8 @@ def get_keyword_filters():
 
 # 添加关键词过滤（管理员功能）
 @main.route('/api/admin/keyword-filters', methods=['POST'])
+@permission_required('admin_content')
 def add_keyword_filter():
-    # 检查是否为管理员
-    if 'user_id' not in session or session.get('role') != 'admin':
-        return jsonify({'message': '没有权限执行此操作'}), 403
-    
     data = request.get_json()
     keyword = data.get('keyword', '').strip()
     
@@ -1545,6 +1768,7 @@ def add_keyword_filter():
     
     db.session.add(new_filter)
     db.session.commit()
+    bump_keyword_version()
     
     return jsonify({
         'message': '关键词过滤规则添加成功',
@@ -1558,29 +1782,25 @@ def add_keyword_filter():
 
 # 删除关键词过滤（管理员功能）
 @main.route('/api/admin/keyword-filters/<int:filter_id>', methods=['DELETE'])
+@permission_required('admin_content')
 def delete_keyword_filter(filter_id):
-    # 检查是否为管理员
-    if 'user_id' not in session or session.get('role') != 'admin':
-        return jsonify({'message': '没有权限执行此操作'}), 403
-    
     filter_rule = KeywordFilter.query.get_or_404(filter_id)
     
     db.session.delete(filter_rule)
     db.session.commit()
+    bump_keyword_version()
     
     return jsonify({'message': '关键词过滤规则删除成功'}), 200
 
 # 切换关键词过滤状态（管理员功能）
 @main.route('/api/admin/keyword-filters/<int:filter_id>/toggle', methods=['POST'])
+@permission_required('admin_content')
 def toggle_keyword_filter(filter_id):
-    # 检查是否为管理员
-    if 'user_id' not in session or session.get('role') != 'admin':
-        return jsonify({'message': '没有权限执行此操作'}), 403
-    
     filter_rule = KeywordFilter.query.get_or_404(filter_id)
     filter_rule.is_active = not filter_rule.is_active
     
     db.session.commit()
+    bump_keyword_version()
     
     status = '启用' if filter_rule.is_active else '禁用'
     return jsonify({
@@ -1592,6 +1812,7 @@ def toggle_keyword_filter(filter_id):
 
 # 获取用户列表（管理员功能）
 @main.route('/api/admin/users', methods=['GET'])
+@read_replica
 def get_users():
     # 检查是否为管理员
     if 'user_id' not in session or session.get('role') != 'admin':
@@ -1604,8 +1825,8 @@ def get_users():
         role_filter = request.args.get('role', '').strip()
         status_filter = request.args.get('status', '').strip()
         
-        # 构建查询
-        query = User.query
+        # 构建查询：用户与计数表外连接，一次查询取回整页数据
+        query = db.session.query(User, UserStats).outerjoin(UserStats, UserStats.user_id == User.id)
         
         # 搜索过滤
         if search:
@@ -1632,11 +1853,9 @@ def get_users():
         )
         
         result = []
-        for user in users.items:
-            # 获取用户统计数据
-            timeline_count = TimelineEntry.query.filter_by(user_id=user.id).count() if hasattr(TimelineEntry, 'user_id') else 0
-            message_count = Message.query.filter_by(user_id=user.id).count()
-            comment_count = MessageComment.query.filter_by(user_id=user.id).count()
+        for user, stats in users.items:
+            # 时间线条目不区分作者，计数固定为 0
+            counts = user_stats.serialize_stats(stats)
             
             user_data = {
                 'id': user.id,
@@ -1651,9 +1870,9 @@ def get_users():
                 'created_at': user.created_at.strftime('%Y-%m-%d %H:%M:%S') if user.created_at else None,
                 'updated_at': user.updated_at.strftime('%Y-%m-%d %H:%M:%S') if user.updated_at else None,
                 'stats': {
-                    'timeline_count': timeline_count,
-                    'message_count': message_count,
-                    'comment_count': comment_count
+                    'timeline_count': 0,
+                    'message_count': counts['message_count'],
+                    'comment_count': counts['comment_count']
                 }
             }
             result.append(user_data)
@@ -1703,10 +1922,8 @@ def get_user_detail(user_id):
                 'created_at': activity[3]
             })
         
-        # 获取用户内容统计
-        timeline_count = TimelineEntry.query.filter_by(user_id=user.id).count() if hasattr(TimelineEntry, 'user_id') else 0
-        message_count = Message.query.filter_by(user_id=user.id).count()
-        comment_count = MessageComment.query.filter_by(user_id=user.id).count()
+        # 获取用户内容统计（读取计数表，时间线条目不区分作者）
+        counts = user_stats.get_stats(user.id)
         
         # 获取用户权限
         permissions = db.session.execute(text("""
@@ -1737,9 +1954,9 @@ def get_user_detail(user_id):
             'created_at': user.created_at.strftime('%Y-%m-%d %H:%M:%S') if user.created_at else None,
             'updated_at': user.updated_at.strftime('%Y-%m-%d %H:%M:%S') if user.updated_at else None,
             'stats': {
-                'timeline_count': timeline_count,
-                'message_count': message_count,
-                'comment_count': comment_count
+                'timeline_count': 0,
+                'message_count': counts['message_count'],
+                'comment_count': counts['comment_count']
             },
             'activities': activity_list,
             'permissions': permission_list
@@ -1790,7 +2007,9 @@ def update_user(user_id):
             user.avatar_url = data['avatar_url']
         
         # 更新时间戳
-        user.updated_at = datetime.now()
+        user.updated_at = datetime.utcnow()
+        invalidate('messages')
+        invalidate_users(user_id)
         
         db.session.commit()
         
@@ -1828,7 +2047,8 @@ def toggle_user_status(user_id):
         
         # 切换状态
         user.is_active = not user.is_active
-        user.updated_at = datetime.now()
+        user.updated_at = datetime.utcnow()
+        invalidate_users(user_id)
         
         db.session.commit()
         
@@ -1877,6 +2097,8 @@ def batch_user_operations():
         
         success_count = 0
         error_messages = []
+        invalidate_users(*(user.id for user in users))
+        invalidate_permissions(*(user.id for user in users))
         
         for user in users:
             try:
@@ -1896,6 +2118,8 @@ def batch_user_operations():
                         error_messages.append(f'不能删除管理员账户: {user.username}')
                         continue
                     # 删除用户相关数据
+                    user_stats.discard_users([user.id])
+                    invalidate('messages')
                     MessageComment.query.filter_by(user_id=user.id).delete()
                     MessageLike.query.filter_by(user_id=user.id).delete()
                     Message.query.filter_by(user_id=user.id).delete()
@@ -1905,7 +2129,7 @@ def batch_user_operations():
                     return jsonify({'message': '不支持的操作类型'}), 400
                 
                 if action != 'delete':
-                    user.updated_at = datetime.now()
+                    user.updated_at = datetime.utcnow()
                 
                 # 记录操作日志
                 if action != 'delete':
@@ -2002,6 +2226,8 @@ def update_user_permissions(user_id):
                 'permission_id': permission_id
             })
         
+        invalidate_users(user_id)
+        invalidate_permissions(user_id)
         db.session.commit()
         
         # 记录管理员操作
@@ -2049,6 +2275,8 @@ def delete_user(user_id):
         """), {'user_id': user_id})
         
         # 删除用户相关内容
+        user_stats.discard_users([user_id])
+        invalidate('messages')
         MessageComment.query.filter_by(user_id=user_id).delete()
         MessageLike.query.filter_by(user_id=user_id).delete()
         Message.query.filter_by(user_id=user_id).delete()
@@ -2058,6 +2286,8 @@ def delete_user(user_id):
         
         # 删除用户
         db.session.delete(user)
+        invalidate_users(user_id)
+        invalidate_permissions(user_id)
         db.session.commit()
         
         return jsonify({'message': '用户删除成功'}), 200
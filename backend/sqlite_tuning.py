@@ -0,0 +1,47 @@
+"""
+Timeline Notebook SQLite 连接参数
+每个新建的 SQLite 连接执行一组 PRAGMA：WAL 日志模式让读写互不阻塞，
+busy_timeout 让写锁冲突时等待而不是立即报 database is locked
+"""
+
+from sqlalchemy import event
+
+from models import db
+
+
+def get_sqlite_pragmas(config):
+    """按配置生成需要执行的 PRAGMA 列表，配置为空的项不设置"""
+    pragmas = [
+        ('journal_mode', config.get('SQLITE_JOURNAL_MODE')),
+        ('busy_timeout', config.get('SQLITE_BUSY_TIMEOUT')),
+        ('synchronous', config.get('SQLITE_SYNCHRONOUS')),
+        ('cache_size', config.get('SQLITE_CACHE_SIZE')),
+        ('mmap_size', config.get('SQLITE_MMAP_SIZE')),
+        ('temp_store', config.get('SQLITE_TEMP_STORE')),
+    ]
+    return [(name, value) for name, value in pragmas if value not in (None, '')]
+
+
+def init_sqlite_pragmas(app):
+    """为应用的所有 SQLite 引擎注册连接事件，新连接建立时执行 PRAGMA"""
+    if not app.config.get('SQLITE_PRAGMAS_ENABLED', True):
+        return
+
+    pragmas = get_sqlite_pragmas(app.config)
+    if not pragmas:
+        return
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas:
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite' and not event.contains(engine, 'connect', set_pragmas):
+                event.listen(engine, 'connect', set_pragmas)
+                # 丢弃注册前已建立的连接，保证所有连接都应用了 PRAGMA
+                engine.dispose()
@@ -0,0 +1,154 @@
+"""
+点赞和评论计数并发压力测试
+在临时 SQLite 数据库上用多线程并发点赞、评论、删除评论，结束后核对计数列与明细行数是否完全一致
+
+用法: python stress_counters.py [--users 100] [--rounds 11] [--threads-per-user 3]
+SQLite 写锁等待超过 busy_timeout 的请求会失败，并发线程很多时可用 SQLITE_BUSY_TIMEOUT 环境变量调大（默认 60000 毫秒）
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from config import config
+from models import db, User, TimelineEntry, Message, MessageComment, MessageLike, UserStats
+from sqlite_tuning import init_sqlite_pragmas
+
+
+def create_app(tmp_dir, workers):
+    app = Flask(__name__)
+    app.config.from_object(config['development'])
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp_dir, 'stress.db')}"
+    # 每个并发线程需要一个连接
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_size': workers, 'max_overflow': 10}
+    app.config['UPLOAD_FOLDER'] = os.path.join(tmp_dir, 'uploads')
+    app.config['PASSWORD_POOL_WORKERS'] = 0
+    app.config['LIKE_WRITE_BEHIND'] = False
+    app.config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 60000))
+
+    db.init_app(app)
+    init_sqlite_pragmas(app)
+
+    from routes import main
+    app.register_blueprint(main)
+
+    from password_pool import password_pool
+    password_pool.init_app(app)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='点赞和评论计数并发压力测试')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=11, help='每个线程点赞/切换点赞的次数')
+    parser.add_argument('--threads-per-user', type=int, default=3, help='同一用户同时发起请求的线程数')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='timeline_stress_')
+    app = create_app(tmp_dir, args.users * args.threads_per_user)
+    try:
+        with app.app_context():
+            db.create_all()
+            users = [User(username=f'stress{i}', email=f'stress{i}@example.com', role='user') for i in range(args.users)]
+            for user in users:
+                user.set_password('stress')
+            entry = TimelineEntry(title='stress', likes=0)
+            db.session.add_all(users + [entry])
+            db.session.commit()
+            message = Message(user_id=users[0].id, content='stress', like_count=0, comment_count=0)
+            db.session.add(message)
+            db.session.commit()
+            entry_id, message_id, author_id = entry.id, message.id, users[0].id
+
+        clients = []
+        for i in range(args.users):
+            client = app.test_client()
+            response = client.post('/api/login', json={'username': f'stress{i}', 'password': 'stress'})
+            assert response.status_code == 200, response.data
+            clients.append(client)
+
+        errors = []
+
+        def send(client, method, url, expected_status, **kwargs):
+            try:
+                response = client.open(url, method=method, **kwargs)
+            except Exception as e:
+                errors.append((method, url, repr(e)[:200]))
+                return None
+            if response.status_code != expected_status:
+                errors.append((method, url, response.status_code, response.data[:200]))
+                return None
+            return response
+
+        def worker(client, index):
+            for _ in range(args.rounds):
+                send(client, 'POST', f'/api/timeline/{entry_id}/like', 200)
+                send(client, 'POST', f'/api/messages/{message_id}/like', 200)
+            # 每个线程发两条评论并删除其中一条
+            created = []
+            for _ in range(2):
+                response = send(client, 'POST', f'/api/messages/{message_id}/comments', 201, json={'content': f'comment {index}'})
+                if response is not None:
+                    created.append(response.json['comment']['id'])
+            if created:
+                send(client, 'DELETE', f'/api/messages/{message_id}/comments/{created[0]}', 200)
+
+        threads = [
+            threading.Thread(target=worker, args=(client, i))
+            for i, client in enumerate(clients)
+            for _ in range(args.threads_per_user)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        requests_sent = len(threads) * (args.rounds * 2 + 3)
+        with app.app_context():
+            entry = db.session.get(TimelineEntry, entry_id)
+            message = db.session.get(Message, message_id)
+            like_rows = MessageLike.query.filter_by(message_id=message_id).count()
+            comment_rows = MessageComment.query.filter_by(message_id=message_id).count()
+            author_stats = db.session.get(UserStats, author_id)
+            author_likes = author_stats.like_count if author_stats is not None else 0
+
+            # 每个用户的点赞切换总次数为奇数时最终处于已点赞状态
+            toggles = args.rounds * args.threads_per_user
+            expected = {
+                'timeline likes': len(threads) * args.rounds,
+                'message like_count': args.users if toggles % 2 else 0,
+                'message like rows': args.users if toggles % 2 else 0,
+                'author like stats': args.users if toggles % 2 else 0,
+                'message comment_count': len(threads),
+                'message comment rows': len(threads),
+            }
+            actual = {
+                'timeline likes': entry.likes,
+                'message like_count': message.like_count,
+                'message like rows': like_rows,
+                'author like stats': author_likes,
+                'message comment_count': message.comment_count,
+                'message comment rows': comment_rows,
+            }
+
+        print(f'请求数: {requests_sent}，失败: {len(errors)}')
+        for error in errors[:5]:
+            print('  ', error)
+
+        ok = not errors
+        for name, value in expected.items():
+            mark = '✅' if actual[name] == value else '❌'
+            ok = ok and actual[name] == value
+            print(f'{mark} {name}: {actual[name]}（期望 {value}）')
+        return 0 if ok else 1
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+Timeline Notebook 登录用户缓存
+按用户 ID 在进程内缓存用户资料和状态（TTL + LRU），每个请求据此校验登录会话，不再每次查询 user 表；
+管理员修改、禁用、删除用户的事务提交后立即清除本进程的缓存，其他 worker 最迟在 TTL 到期后生效
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from commit_hooks import on_outer_commit
+from models import db, User
+
+# 用户不存在时也缓存，避免已删除账户的旧会话每次都查库
+_MISSING = object()
+
+
+def snapshot_user(user):
+    """缓存的用户字段，与个人资料接口的返回一致"""
+    return {
+        'id': user.id,
+        'username': user.username,
+        'email': user.email,
+        'bio': user.bio,
+        'avatar_url': user.get_avatar_url(),
+        'role': user.role,
+        'is_active': user.is_active,
+        'created_at': user.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'updated_at': user.updated_at.strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+
+class UserCache:
+    def __init__(self, app=None):
+        self.app = None
+        self.ttl = 10
+        self.max_size = 10000
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['user_cache'] = self
+        self.ttl = app.config.get('USER_CACHE_TTL', 10)
+        self.max_size = app.config.get('USER_CACHE_MAX_SIZE', 10000)
+
+    def get(self, user_id):
+        """返回用户资料（dict），用户不存在时返回 None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] >= now:
+                self._entries.move_to_end(user_id)
+                return None if entry[0] is _MISSING else entry[0]
+
+        user = db.session.get(User, user_id)
+        value = snapshot_user(user) if user else _MISSING
+        with self._lock:
+            self._entries[user_id] = (value, now + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return None if value is _MISSING else value
+
+    def discard(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+
+def invalidate_users(*user_ids):
+    """标记当前事务修改了哪些用户，事务提交后清除缓存"""
+    db.session.info.setdefault('user_cache_invalidate', set()).update(user_ids)
+
+
+def _discard_users(user_ids):
+    user_cache.discard(*user_ids)
+
+
+on_outer_commit('user_cache_invalidate', _discard_users)
+
+
+user_cache = UserCache()
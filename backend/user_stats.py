@@ -0,0 +1,130 @@
+"""
+Timeline Notebook 用户计数
+user_stats 表冗余保存每个用户的留言数、评论数和获赞数，增删路径用原子 UPDATE 维护，
+rebuild_user_stats 从明细表重新统计，用于数据还原后或计数出现偏差时校正
+"""
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, User, UserStats, Message, MessageComment, MessageLike
+
+COUNTER_FIELDS = ('message_count', 'comment_count', 'like_count')
+
+
+def bump(user_id, **deltas):
+    """在当前事务中原子地调整用户计数，如 bump(1, message_count=1)"""
+    if not user_id or not deltas:
+        return
+
+    values = {field: getattr(UserStats, field) + delta for field, delta in deltas.items()}
+    result = db.session.execute(update(UserStats).where(UserStats.user_id == user_id).values(**values))
+    if result.rowcount:
+        return
+
+    # 该用户还没有计数行，先插入；并发插入冲突时回退为更新
+    try:
+        with db.session.begin_nested():
+            db.session.add(UserStats(user_id=user_id, **{field: max(delta, 0) for field, delta in deltas.items()}))
+    except IntegrityError:
+        db.session.execute(update(UserStats).where(UserStats.user_id == user_id).values(**values))
+
+
+def get_stats(user_id):
+    """读取单个用户的计数，没有计数行时返回全 0"""
+    stats = db.session.get(UserStats, user_id)
+    return {field: (getattr(stats, field) if stats else 0) for field in COUNTER_FIELDS}
+
+
+def serialize_stats(stats):
+    return {field: (getattr(stats, field) if stats else 0) for field in COUNTER_FIELDS}
+
+
+def count_grouped(key_column, ids=None, count_column=None, join=None, chunk_size=500):
+    """
+    批量分组计数：SELECT key, COUNT(*) ... WHERE key IN (ids) GROUP BY key
+    返回 {id: 数量}，没有记录的 id 不出现在结果中；ids 为 None 时统计全部
+    join 为 (目标模型, 连接条件)，用于按关联表的列分组（如按留言作者统计点赞）
+    """
+    stmt = select(key_column, func.count(count_column if count_column is not None else key_column))
+    if join is not None:
+        stmt = stmt.join(*join)
+    stmt = stmt.group_by(key_column)
+
+    if ids is None:
+        return dict(db.session.execute(stmt).all())
+
+    # 分块查询，避免超出数据库参数个数限制
+    ids = list(ids)
+    counts = {}
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        counts.update(db.session.execute(stmt.where(key_column.in_(chunk))).all())
+    return counts
+
+
+def compute_user_stats(user_ids=None):
+    """
+    按明细表分组统计用户计数，每张表一次查询，返回 {user_id: {字段: 值}}
+    user_ids 为 None 时统计全部用户
+    """
+    message_counts = count_grouped(Message.user_id, user_ids, Message.id)
+    comment_counts = count_grouped(MessageComment.user_id, user_ids, MessageComment.id)
+    like_counts = count_grouped(Message.user_id, user_ids, MessageLike.id,
+                                join=(MessageLike, MessageLike.message_id == Message.id))
+
+    if user_ids is None:
+        user_ids = [row[0] for row in db.session.execute(select(User.id))]
+
+    return {
+        user_id: {
+            'message_count': message_counts.get(user_id, 0),
+            'comment_count': comment_counts.get(user_id, 0),
+            'like_count': like_counts.get(user_id, 0),
+        }
+        for user_id in user_ids
+    }
+
+
+def rebuild_user_stats(user_ids=None):
+    """从明细表重建计数（user_ids 为 None 时重建全部），返回重建的用户数"""
+    stats = compute_user_stats(user_ids)
+
+    delete_stmt = UserStats.__table__.delete()
+    if user_ids is not None:
+        delete_stmt = delete_stmt.where(UserStats.user_id.in_(user_ids))
+    db.session.execute(delete_stmt)
+
+    rows = [{'user_id': user_id, **counts} for user_id, counts in stats.items()]
+    if rows:
+        db.session.execute(UserStats.__table__.insert(), rows)
+    return len(rows)
+
+
+def clear_user_stats():
+    """清空计数表（批量改写用户及内容数据前调用，完成后用 rebuild_user_stats 重建）"""
+    db.session.execute(UserStats.__table__.delete())
+
+
+def ensure_user_stats():
+    """计数表为空而已有用户时（新部署或升级后首次启动）执行一次全量重建"""
+    if db.session.query(UserStats.user_id).first() is None and db.session.query(User.id).first() is not None:
+        rebuild_user_stats()
+        db.session.commit()
+
+
+def discard_users(user_ids):
+    """
+    删除用户前调用（需在删除其点赞之前）：扣减这些用户点赞过的留言作者的获赞数，
+    并删除这些用户自己的计数行
+    """
+    rows = db.session.execute(
+        select(Message.user_id, func.count(MessageLike.id))
+        .join(MessageLike, MessageLike.message_id == Message.id)
+        .where(MessageLike.user_id.in_(user_ids), Message.user_id.notin_(user_ids))
+        .group_by(Message.user_id)
+    ).all()
+    for author_id, count in rows:
+        bump(author_id, like_count=-count)
+
+    db.session.execute(UserStats.__table__.delete().where(UserStats.user_id.in_(user_ids)))